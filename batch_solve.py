@@ -0,0 +1,264 @@
+'''
+
+Batch solver: solve every warehouse of a directory or glob pattern with
+'mySokobanSolver.py', several levels at a time.
+
+Each level is solved in its own process, at most --processes at once, so a
+level that runs out of time (--timeout) is killed without disturbing the
+others, and the address space of each process is capped (--memory, on
+systems with the 'resource' module). On Unix each level runs in a process
+group of its own, so the worker processes of --method hda or portfolio are
+killed with it. One JSON line is written per level
+as soon as it finishes:
+    {"level": path, "status": status, "solution": [...], "cost": C,
+     "time": seconds, "nodes": expanded nodes}
+where status is 'solved', 'impossible', 'timeout', 'memory' or 'error'
+(with an "error" field). solution, cost and nodes are null when unknown.
+
+With --resume, the levels that already have a line in the output file are
+skipped and the new lines are appended, so an interrupted run can be
+completed.
+
+Usage:
+    python batch_solve.py [options] warehouses/
+    python batch_solve.py [options] 'warehouses/warehouse_0*.txt' -o out.jsonl
+
+'''
+
+import argparse
+import glob
+import json
+import multiprocessing
+import multiprocessing.connection
+import os
+import signal
+import sys
+import time
+
+try:
+    import resource  # Unix only
+except ImportError:
+    resource = None
+
+from sokoban import Warehouse
+
+import mySokobanSolver as solver
+
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+
+def find_levels(patterns):
+    '''
+    @param patterns: directories (all their *.txt files) or glob patterns
+
+    Return:
+        the sorted list of the paths of the levels, without duplicates
+    '''
+    levels = set()
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            pattern = os.path.join(pattern, '*.txt')
+        levels.update(os.path.normpath(path) for path in glob.glob(pattern)
+                      if os.path.isfile(path))
+    return sorted(levels)
+
+
+def done_levels(path):
+    '''
+    @param path: an output file of a previous run
+
+    Return:
+        the set of the levels that have a line in the file (a truncated last
+        line is ignored)
+    '''
+    done = set()
+    if not os.path.exists(path):
+        return done
+    with open(path) as f:
+        for line in f:
+            try:
+                done.add(json.loads(line)['level'])
+            except (ValueError, KeyError):
+                continue
+    return done
+
+
+def solve_level(level, options, memory, conn):
+    '''
+    Solve one level, in a child process, and send its record on conn.
+
+    @param level: path of the warehouse file
+    @param options: keyword arguments of solve_weighted_sokoban
+    @param memory: cap of the address space in MB, None for no cap
+    @param conn: the child end of a multiprocessing Pipe
+    '''
+    if hasattr(os, 'setsid'):
+        os.setsid()  # own process group, with the processes it starts
+    if memory and resource is not None:
+        cap = memory * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (cap, cap))
+    record = dict(level=level, status='error', solution=None, cost=None,
+                  time=None, nodes=None)
+    start = time.perf_counter()
+    try:
+        warehouse = Warehouse()
+        warehouse.load_warehouse(level)
+        stats = {}
+        S, C = solver.solve_weighted_sokoban(warehouse, stats=stats,
+                                             **options)
+        record.update(nodes=stats.get('expanded'))
+        if C is None:
+            record.update(status='impossible')
+        else:
+            record.update(status='solved', solution=S, cost=C)
+    except MemoryError:
+        record.update(status='memory')
+    except Exception as e:
+        record.update(error='{}: {}'.format(type(e).__name__, e))
+    record.update(time=round(time.perf_counter() - start, 3))
+    conn.send(record)
+    conn.close()
+
+
+def kill_level(process):
+    '''
+    Kill the process of a level and the processes it started.
+
+    @param process: a Process running solve_level
+    '''
+    if hasattr(os, 'killpg'):
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except OSError:  # the group is gone already
+            pass
+    process.kill()
+    process.join()
+
+
+def end_line(path):
+    '''
+    Terminate the last line of a file with a newline if it has none (a
+    line truncated by an interrupted run), so that lines appended to the
+    file start on a line of their own.
+
+    @param path: path of a file, which may not exist
+    '''
+    if not os.path.exists(path):
+        return
+    with open(path, 'rb+') as f:
+        f.seek(0, os.SEEK_END)
+        if f.tell() == 0:
+            return
+        f.seek(-1, os.SEEK_END)
+        if f.read(1) != b'\n':
+            f.write(b'\n')
+
+
+def run(levels, options, out, processes=1, timeout=None, memory=None):
+    '''
+    Solve the levels, at most processes at a time, and write the record of
+    each level to out as soon as it is known.
+
+    @param levels: paths of the warehouse files
+    @param options: keyword arguments of solve_weighted_sokoban
+    @param out: text file the JSON lines are written to
+    @param processes: number of levels solved at once
+    @param timeout: wall-clock limit of a level in seconds, None for none
+    @param memory: cap of the address space of a level in MB, None for none
+
+    Return:
+        the list of the statuses of the records written
+    '''
+    pending = list(reversed(levels))
+    running = {}  # parent end of the pipe -> (level, process, start)
+    statuses = []
+
+    def write(record):
+        out.write(json.dumps(record) + '\n')
+        out.flush()
+        statuses.append(record['status'])
+
+    while pending or running:
+        while pending and len(running) < processes:
+            level = pending.pop()
+            parent, child = multiprocessing.Pipe(duplex=False)
+            process = multiprocessing.Process(
+                target=solve_level, args=(level, options, memory, child))
+            process.start()
+            child.close()
+            running[parent] = level, process, time.perf_counter()
+        for conn in multiprocessing.connection.wait(list(running), 0.1):
+            level, process, start = running.pop(conn)
+            try:
+                write(conn.recv())
+            except EOFError:  # the process died without a record
+                kill_level(process)
+                write(dict(level=level, status='error', solution=None,
+                           cost=None, nodes=None,
+                           time=round(time.perf_counter() - start, 3),
+                           error='exit code {}'.format(process.exitcode)))
+            conn.close()
+            process.join()
+        now = time.perf_counter()
+        for conn, (level, process, start) in list(running.items()):
+            if timeout is not None and now - start > timeout:
+                kill_level(process)
+                conn.close()
+                del running[conn]
+                write(dict(level=level, status='timeout', solution=None,
+                           cost=None, time=round(now - start, 3), nodes=None))
+    return statuses
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Solve a batch of Sokoban warehouses in parallel.')
+    parser.add_argument('levels', nargs='+',
+                        help='directories or glob patterns of warehouse files')
+    parser.add_argument('-o', '--output',
+                        help='JSON lines output file (default: stdout)')
+    parser.add_argument('--resume', action='store_true',
+                        help='skip the levels already in the output file')
+    parser.add_argument('-j', '--processes', type=int,
+                        default=os.cpu_count() or 1,
+                        help='levels solved at once (default: CPU count)')
+    parser.add_argument('--timeout', type=float, default=60,
+                        help='seconds per level, 0 for no limit (default: 60)')
+    parser.add_argument('--memory', type=int, default=None,
+                        help='address space cap per level, in MB')
+    parser.add_argument('--method', default='astar',
+                        choices=('astar', 'ida', 'hda', 'bidirectional',
+                                 'portfolio'))
+    parser.add_argument('--macro', action='store_true',
+                        help='search over box pushes')
+    parser.add_argument('--compact', action='store_true',
+                        help='bitmask states')
+    parser.add_argument('--tunnels', action='store_true')
+    parser.add_argument('--goal-rooms', action='store_true')
+    args = parser.parse_args(argv)
+
+    if args.resume and not args.output:
+        parser.error('--resume needs an --output file')
+    levels = find_levels(args.levels)
+    if args.resume:
+        end_line(args.output)
+        done = done_levels(args.output)
+        levels = [level for level in levels if level not in done]
+    options = dict(method=args.method, macro=args.macro, compact=args.compact,
+                   tunnels=args.tunnels, goal_rooms=args.goal_rooms)
+    out = (open(args.output, 'a' if args.resume else 'w') if args.output
+           else sys.stdout)
+    try:
+        statuses = run(levels, options, out, max(1, args.processes),
+                       args.timeout or None, args.memory)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    summary = ', '.join('{} {}'.format(statuses.count(status), status)
+                        for status in sorted(set(statuses)))
+    print('{} levels: {}'.format(len(statuses), summary or 'nothing to do'),
+          file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,263 @@
+'''
+
+Benchmark of 'mySokobanSolver.py' over a fixed, tiered subset of the
+bundled warehouses.
+
+For each level of the selected tiers it measures
+    solve_time   : wall time of solve_weighted_sokoban (SOLVER_OPTIONS)
+    nodes        : nodes expanded by the search
+    generated    : nodes generated by the search
+    peak_kb      : peak memory allocated during the search (tracemalloc)
+    cost         : cost of the solution (None if impossible)
+    taboo_time   : wall time of taboo_cells
+    actions_time : wall time of SokobanPuzzle.actions on every state of
+                   the solution
+    h_time       : wall time of SokobanPuzzle.h on every state of the
+                   solution (without the incremental matching of a parent)
+    check_time   : wall time of check_elem_action_seq on the solution
+Each run of a timing calls the function as many times as fit in
+MIN_RUN_TIME seconds (at least once), each call with an empty Board cache,
+and measures the mean time of a call. A time is the minimum over --repeat
+runs, and its spread (the median minus the minimum) is recorded with it as
+an estimate of the noise. The other metrics come from a separate run
+(tracemalloc slows the solver down).
+
+--save writes the results to a baseline file. --baseline compares them to
+a baseline file and exits with status 1 if the peak memory grew by more
+than --threshold (relative), a time by more than --threshold and by more
+than NOISE_FACTOR times its spread (in the baseline or now), a node count
+by more than --count-threshold, or a cost changed.
+
+Usage:
+    python benchmark.py [--tiers small medium] [--save baseline.json]
+    python benchmark.py --baseline baseline.json [--threshold 0.25]
+
+'''
+
+import argparse
+import gc
+import json
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+
+import search
+from sokoban import Warehouse
+
+import mySokobanSolver as solver
+
+# levels of each tier, by solving time with SOLVER_OPTIONS (up to 20 ms,
+# about 0.1 s, from 0.2 s to about 1 s)
+TIERS = {
+    'small': ['warehouse_01.txt', 'warehouse_01_a.txt', 'warehouse_03.txt',
+              'warehouse_03_impossible.txt', 'warehouse_09.txt',
+              'warehouse_21.txt', 'warehouse_47.txt', 'warehouse_8a.txt'],
+    'medium': ['warehouse_11.txt', 'warehouse_13.txt', 'warehouse_37.txt',
+               'warehouse_5n.txt', 'warehouse_61.txt', 'warehouse_119.txt',
+               'warehouse_149.txt', 'warehouse_155.txt'],
+    'large': ['warehouse_07.txt', 'warehouse_59.txt', 'warehouse_69.txt',
+              'warehouse_77.txt', 'warehouse_95.txt', 'warehouse_127.txt',
+              'warehouse_157.txt'],
+}
+
+# keyword arguments of solve_weighted_sokoban for the benchmark
+SOLVER_OPTIONS = dict(macro=True, compact=True)
+
+TIME_METRICS = ('solve_time', 'taboo_time', 'actions_time', 'h_time',
+                'check_time')
+COUNT_METRICS = ('nodes', 'generated')
+
+# minimum duration of a run of a timing, in seconds
+MIN_RUN_TIME = 0.1
+# a time only regresses if it grew by more than this many times its spread
+NOISE_FACTOR = 3
+# time differences below this many seconds are never regressions
+MIN_TIME_DELTA = 0.0005
+
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+
+def timed(fn, repeat):
+    '''
+    @param fn: function without arguments, called with an empty Board cache
+        (it should work on a copy of its warehouse, which has no Board
+        memoized on it, see 'compile_board')
+    @param repeat: number of runs, of at least MIN_RUN_TIME seconds each
+
+    Return:
+        (time, spread, result of the last call) where time is the minimum
+        over the runs of the mean wall time of a call in seconds, and spread
+        the median of these means minus time
+    '''
+    runs = []
+    for _ in range(repeat):
+        gc.collect()
+        calls, elapsed = 0, 0.0
+        while calls == 0 or elapsed < MIN_RUN_TIME:
+            solver._boards.clear()
+            start = time.perf_counter()
+            result = fn()
+            elapsed += time.perf_counter() - start
+            calls += 1
+        runs.append(elapsed / calls)
+    best = min(runs)
+    return best, statistics.median(runs) - best, result
+
+
+def solution_states(warehouse, actions):
+    '''
+    @param warehouse: a valid Warehouse object
+    @param actions: a solution, list of elementary actions
+
+    Return:
+        (puzzle, states) where states are the states of the compact
+        SokobanPuzzle of warehouse along the solution, initial state first
+    '''
+    sp = solver.SokobanPuzzle(warehouse, compact=True)
+    states = [sp.initial]
+    for action in actions:
+        states.append(sp.result(states[-1], action))
+    return sp, states
+
+
+def bench_level(path, repeat):
+    '''
+    @param path: path of a warehouse file
+    @param repeat: number of runs of each timing
+
+    Return:
+        dict of the metrics of the level (see the module docstring)
+    '''
+    warehouse = Warehouse()
+    warehouse.load_warehouse(path)
+
+    solver._boards.clear()
+    stats = {}
+    gc.collect()
+    tracemalloc.start()
+    S, C = solver.solve_weighted_sokoban(warehouse, stats=stats,
+                                         **SOLVER_OPTIONS)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    if C is None:
+        S = []
+    metrics = dict(cost=C, nodes=stats['expanded'],
+                   generated=stats['generated'], peak_kb=peak // 1024)
+
+    timings = dict(
+        solve_time=lambda: solver.solve_weighted_sokoban(warehouse.copy(),
+                                                         **SOLVER_OPTIONS),
+        taboo_time=lambda: solver.taboo_cells(warehouse.copy()))
+    sp, states = solution_states(warehouse, S)
+    timings.update(
+        actions_time=lambda: [sp.actions(state) for state in states],
+        h_time=lambda: [sp.h(search.Node(state)) for state in states],
+        check_time=lambda: solver.check_elem_action_seq(warehouse.copy(), S))
+    for name, fn in timings.items():
+        metrics[name], metrics[name + '_spread'], _ = timed(fn, repeat)
+    return metrics
+
+
+def run(tiers, repeat, directory='warehouses'):
+    '''
+    @param tiers: names of tiers of TIERS
+    @param repeat: number of runs of each timing
+    @param directory: directory of the warehouse files
+
+    Return:
+        dict mapping 'tier/level' to the metrics of the level
+    '''
+    results = {}
+    for tier in tiers:
+        for level in TIERS[tier]:
+            metrics = bench_level('{}/{}'.format(directory, level), repeat)
+            results['{}/{}'.format(tier, level)] = metrics
+            print('{:<36} cost {:>5} nodes {:>7} peak {:>7} KB '
+                  'solve {:8.4f}s'.format(
+                      '{}/{}'.format(tier, level), str(metrics['cost']),
+                      metrics['nodes'], metrics['peak_kb'],
+                      metrics['solve_time']), flush=True)
+    return results
+
+
+def compare(results, baseline, threshold, count_threshold):
+    '''
+    @param results: dict returned by 'run'
+    @param baseline: dict returned by 'run' for the baseline
+    @param threshold: allowed relative growth of the times and of peak_kb
+        (a time is also allowed to grow by NOISE_FACTOR times its spread)
+    @param count_threshold: allowed relative growth of the node counts
+
+    Return:
+        the list of the descriptions of the regressions
+    '''
+    regressions = []
+    for case, metrics in sorted(results.items()):
+        old = baseline.get(case)
+        if old is None:
+            continue
+        if metrics['cost'] != old['cost']:
+            regressions.append('{}: cost {} -> {}'.format(
+                case, old['cost'], metrics['cost']))
+        for name, value in sorted(metrics.items()):
+            before = old.get(name)
+            if (name == 'cost' or name.endswith('_spread') or before is None
+                    or value is None):
+                continue
+            if name in COUNT_METRICS:
+                limit = before * (1 + count_threshold)
+            else:
+                limit = before * (1 + threshold)
+                if name in TIME_METRICS:
+                    noise = max(metrics.get(name + '_spread', 0),
+                                old.get(name + '_spread', 0))
+                    limit = max(limit, before + NOISE_FACTOR * noise,
+                                before + MIN_TIME_DELTA)
+            if value > limit:
+                regressions.append('{}: {} {:g} -> {:g} ({:+.0%})'.format(
+                    case, name, before, value,
+                    value / before - 1 if before else float('inf')))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Benchmark the Sokoban solver on the bundled warehouses.')
+    parser.add_argument('--tiers', nargs='+', default=list(TIERS),
+                        choices=list(TIERS))
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='runs of each timing, the minimum is kept')
+    parser.add_argument('--save', help='write the results to this file')
+    parser.add_argument('--baseline', help='compare to this results file')
+    parser.add_argument('--threshold', type=float, default=0.25,
+                        help='allowed relative growth of times and memory')
+    parser.add_argument('--count-threshold', type=float, default=0.0,
+                        help='allowed relative growth of node counts')
+    args = parser.parse_args(argv)
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline['options'] != SOLVER_OPTIONS:
+            parser.error('the baseline was run with other solver options')
+    results = run(args.tiers, max(1, args.repeat))
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(dict(options=SOLVER_OPTIONS,
+                           python=platform.python_version(),
+                           results=results), f, indent=1, sort_keys=True)
+    if baseline is not None:
+        regressions = compare(results, baseline['results'], args.threshold,
+                              args.count_threshold)
+        for regression in regressions:
+            print('REGRESSION', regression)
+        if regressions:
+            sys.exit(1)
+        print('no regression against', args.baseline)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+'''
+
+Offline builder of the deadlock pattern database of 'mySokobanSolver.py'
+
+A pattern is the 3x3 window of cells centred on a box that was just pushed.
+Each cell of the window is a wall, a floor cell, a target, a box or a box on
+a target (see the PATTERN_* codes of mySokobanSolver). The builder
+enumerates every window with a box in the centre and proves which of them
+are deadlocks by an exhaustive search over the pushes of the boxes of the
+window, assuming the most favourable surroundings:
+    - the cells around the window are free floor the worker can walk on
+    - a box pushed out of the window is gone (it no longer needs a target)
+    - the worker may start on any free cell
+A window where the boxes left in it can never all stand on targets is a
+deadlock in any warehouse, whatever the other cells and boxes are.
+
+The database is one bit per window index (see pattern_index) after the
+PATTERN_DB_MAGIC header. mySokobanSolver memory-maps it at import time.
+
+Usage:
+    python build_deadlock_db.py [path]
+
+'''
+
+import itertools
+import sys
+
+import mySokobanSolver as solver
+
+# window cell i is at (1 + i % 3, 1 + i // 3) on a 5x5 grid, the outer
+# ring of the grid being the free cells around the window
+WINDOW = [(1 + i % 3, 1 + i // 3) for i in range(9)]
+GRID = [(x, y) for y in range(5) for x in range(5)]
+
+# the 8 symmetries of the square, as permutations of the window cells
+SYMMETRIES = []
+for swap in (False, True):
+    for sx in (1, -1):
+        for sy in (1, -1):
+            permutation = []
+            for i in range(9):
+                u, v = i % 3 - 1, i // 3 - 1
+                if swap:
+                    u, v = v, u
+                permutation.append((1 + sy * v) * 3 + 1 + sx * u)
+            SYMMETRIES.append(permutation)
+
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+
+def pattern_index(codes):
+    '''
+    @param codes: the 9 PATTERN_* codes of a window, in reading order
+
+    Return:
+        the index of the window in the database
+    '''
+    return sum(code * 5 ** i for i, code in enumerate(codes))
+
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+
+def is_deadlock(codes):
+    '''
+    Exhaustive search over the pushes of the boxes of a window.
+
+    @param codes: the 9 PATTERN_* codes of a window, in reading order
+
+    Return:
+        True if the boxes can't all be pushed onto targets or out of the
+        window, wherever the worker starts
+    '''
+    walls = {WINDOW[i] for i, code in enumerate(codes)
+             if code == solver.PATTERN_WALL}
+    targets = {WINDOW[i] for i, code in enumerate(codes)
+               if code in (solver.PATTERN_TARGET, solver.PATTERN_BOX_ON_TARGET)}
+    boxes = frozenset(WINDOW[i] for i, code in enumerate(codes)
+                      if code in (solver.PATTERN_BOX, solver.PATTERN_BOX_ON_TARGET))
+    window = set(WINDOW)
+    floor = set(GRID) - walls
+
+    def region(worker, boxes):
+        # cells the worker can walk to, and their top-left-most cell
+        seen, stack = {worker}, [worker]
+        while stack:
+            x, y = stack.pop()
+            for dx, dy in solver.DIRECTIONS.values():
+                cell = (x + dx, y + dy)
+                if cell in floor and cell not in boxes and cell not in seen:
+                    seen.add(cell)
+                    stack.append(cell)
+        return seen, min(seen, key=lambda cell: (cell[1], cell[0]))
+
+    frontier, seen = [], set()
+    for cell in GRID:
+        if cell in floor and cell not in boxes:
+            reach, top = region(cell, boxes)
+            if (boxes, top) not in seen:
+                seen.add((boxes, top))
+                frontier.append((boxes, reach))
+
+    while frontier:
+        boxes, reach = frontier.pop()
+        if boxes <= targets:
+            return False
+        for (x, y) in boxes:
+            for dx, dy in solver.DIRECTIONS.values():
+                ahead, behind = (x + dx, y + dy), (x - dx, y - dy)
+                if behind not in reach or ahead not in floor or ahead in boxes:
+                    continue
+                pushed = boxes - {(x, y)}
+                if ahead in window:
+                    pushed = pushed | {ahead}
+                reach2, top = region((x, y), pushed)
+                if (pushed, top) not in seen:
+                    seen.add((pushed, top))
+                    frontier.append((pushed, reach2))
+    return True
+
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+
+def build():
+    '''
+    Return:
+        the database, a bytearray with one bit per window index
+    '''
+    db = bytearray((5 ** 9 + 7) // 8)
+    known = {}  # results by canonical window (smallest symmetric variant)
+    centres = (solver.PATTERN_BOX, solver.PATTERN_BOX_ON_TARGET)
+    for others in itertools.product(range(5), repeat=8):
+        for centre in centres:
+            codes = others[:4] + (centre,) + others[4:]
+            canonical = min(tuple(codes[p[i]] for i in range(9))
+                            for p in SYMMETRIES)
+            dead = known.get(canonical)
+            if dead is None:
+                dead = known[canonical] = is_deadlock(codes)
+            if dead:
+                index = pattern_index(codes)
+                db[index >> 3] |= 1 << (index & 7)
+    return db
+
+
+if __name__ == "__main__":
+    path = sys.argv[1] if len(sys.argv) > 1 else solver.PATTERN_DB_PATH
+    db = build()
+    with open(path, 'wb') as f:
+        f.write(solver.PATTERN_DB_MAGIC)
+        f.write(db)
+    print('{} deadlock windows written to {}'.format(
+        sum(bin(byte).count('1') for byte in db), path))
@@ -18,9 +18,11 @@ __version__ = "2.0"
 try:
     from fredSokobanSolver import solve_weighted_sokoban
     print("Using Fred's solver")
+    solver_stats = False
 except ModuleNotFoundError:
     from mySokobanSolver import solve_weighted_sokoban
     print("Using submitted solver")
+    solver_stats = True  # solve_weighted_sokoban fills a stats dict
 
     
 
@@ -278,9 +280,20 @@ def solve_puzzle():
         return
     print('\nStarting to think...\n')
     t0 = time.time()
-    solution, total_cost = solve_weighted_sokoban(warehouse)
+    stats = {}
+    if solver_stats:
+        solution, total_cost = solve_weighted_sokoban(warehouse, stats=stats)
+    else:
+        solution, total_cost = solve_weighted_sokoban(warehouse)
     t1 = time.time()
     print (f'\nAnalysis took {t1-t0:.6f} seconds\n')
+    if stats:
+        print(f"{stats['expanded']} nodes expanded "
+              f"({stats['nodes_per_second']:.0f} nodes per second), "
+              f"{stats['generated']} generated, "
+              f"{stats['duplicates']} duplicates\n"
+              f"Largest frontier {stats['max_frontier']} nodes, "
+              f"largest explored set {stats['max_explored']} states\n")
     if solution == 'impossible':
         print('\nNo solution found!\n')
     else:
@@ -29,9 +29,71 @@ Last modified by 2022-03-27  by f.maire@qut.edu.au
 # You have to make sure that your code works with
 # the files provided (search.py and sokoban.py) as your code will be tested
 # with these files
+import collections
+import hashlib
+import itertools
+import mmap
+import multiprocessing
+import os
+import pickle
+import random
+import time
+
 import search
 import sokoban
 
+# (dx, dy) offset of each elementary action, x <-> columns, y <-> rows
+DIRECTIONS = {'Up': (0, -1), 'Down': (0, 1), 'Left': (-1, 0), 'Right': (1, 0)}
+
+# the action that undoes each elementary action
+OPPOSITE = {'Up': 'Down', 'Down': 'Up', 'Left': 'Right', 'Right': 'Left'}
+
+# seed of the Zobrist keys of compact states (see BitState)
+ZOBRIST_SEED = 2022
+
+# cost of a box/target pair in the matching of SokobanPuzzle.h when the box
+# can't be pushed to the target
+UNREACHABLE = 10 ** 9
+
+# maximum number of states of the sub-search that tries to prove that a
+# corral is a deadlock (see SokobanMacroPuzzle.corral_deadlock)
+CORRAL_SEARCH_LIMIT = 500
+
+# largest goal room, in cells (see Board.rooms)
+GOAL_ROOM_MAX_CELLS = 40
+
+# maximum number of placements of the boxes on the targets the backward
+# search of 'solve_bidirectional_sokoban' starts from
+GOAL_PLACEMENT_LIMIT = 1000
+
+# configurations (keyword arguments of solve_weighted_sokoban) raced by
+# solve_weighted_sokoban_portfolio, the optimal ones first
+PORTFOLIO = (
+    dict(macro=True, compact=True),
+    dict(compact=True),
+    dict(macro=True, compact=True, method='ida'),
+    dict(compact=True, tunnels=True, goal_rooms=True),
+    dict(method='bidirectional'),
+)
+
+# number of Boards kept in memory by compile_board, least recently used
+# first out
+BOARD_CACHE_SIZE = 32
+# directory where compile_board also stores the Boards, None to keep them
+# in memory only
+BOARD_CACHE_DIR = os.environ.get('SOKOBAN_BOARD_CACHE')
+# bumped whenever the attributes of Board change, so that Boards saved by an
+# older version are not loaded
+BOARD_CACHE_VERSION = 1
+
+# codes of the cells of a deadlock pattern, the 3x3 window centred on a
+# pushed box (see build_deadlock_db.py and SokobanPuzzle.pattern_deadlock)
+(PATTERN_WALL, PATTERN_FLOOR, PATTERN_TARGET,
+ PATTERN_BOX, PATTERN_BOX_ON_TARGET) = range(5)
+PATTERN_DB_MAGIC = b'SOKPDB1\n'
+PATTERN_DB_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                               'deadlock_patterns.db')
+
 # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 
 
@@ -51,106 +113,456 @@ def my_team():
 # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 def taboo_cells(warehouse):
     """
-    Identify the taboo cells of a warehouse. A "taboo cell" is by definition
-    -77,14 +75,93 @@ def taboo_cells(warehouse):
+    Identify the taboo cells of a warehouse. A "taboo cell" is a cell from
+    which a box can't be pushed onto any target, even if it is the only box
+    in the warehouse. This covers the corners that are not targets and the
+    cells along a wall between two such corners with no target in between.
+    The cells are the dead cells of the Board of the warehouse, found with
+    one reverse "pull" flood fill from all the targets (see
+    Board.pull_distances).
+
+    @param warehouse:
+        a Warehouse object with the worker inside the warehouse
+
+    @return
+       A string representing the warehouse with only the wall cells marked with
+       a '#' and the taboo cells marked with a 'X'.
        The returned string should NOT have marks for the worker, the targets,
        and the boxes.
     """
 
-    # some constants
-    wall = '#'
-    targets = ['.', '!', '*']
-    unwanted = ['$', '@']
-    taboo = 'X'
-
-    def corner(wh, x, y, isWall=False):
-        """
-        Checks if next to a wall on left/right and up/down
-        """
-        # init wall count
-        vertWalls = 0
-        horizWalls = 0
-        # check for walls above and below
-        for (dx, dy) in [(0, 1), (0, -1)]:
-            if wh[y + dy][x + dx] == wall:
-                vertWalls += 1
-        # check for walls left and right
-        for (dx, dy) in [(1, 0), (-1, 0)]:
-            if wh[y + dy][x + dx] == wall:
-                horizWalls += 1
-        if isWall:
-            return (vertWalls >= 1) or (horizWalls >= 1)
-        else:
-            return (vertWalls >= 1) and (horizWalls >= 1)
+    # A box on a dead cell can't be pushed to any target, even alone
+    board = compile_board(warehouse)
+    vis = [['#' if board.kind[y * board.ncols + x] == Board.WALL else ' '
+            for x in range(board.ncols)] for y in range(board.nrows)]
+    for (x, y), dead in zip(board.cells, board.dead):
+        if dead:
+            vis[y][x] = 'X'
 
-    def Rule1(warehouse):
+    # Result
+    return '\n'.join(''.join(line) for line in vis)
+
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+
+class Board:
+    """
+    Compiled model of the static part of a warehouse (walls, targets and
+    dead cells), built once per layout by 'compile_board'.
+
+    The interior cells (the non-wall cells inside the outer wall) are given
+    integer ids 0, 1, ... in reading order. Attributes:
+        ncols, nrows : size of the grid
+        kind : flat bytearray of the cell types of the grid, indexed by
+               y * ncols + x, with values OUTSIDE, WALL, FLOOR or TARGET
+        cells : cells[i] is the (x, y) coordinate of interior cell i
+        index : dict mapping the (x, y) coordinate of an interior cell to its id
+        neighbours : dict mapping each move of DIRECTIONS to a list,
+               neighbours[move][i] is the id of the interior cell next to
+               cell i in that direction, or -1 if that cell is a wall
+        moves : list of the (move, neighbours[move]) pairs
+        pushes : list of the (move, neighbours[move], neighbours[opposite
+               move]) triples, the cell ahead of and behind a pushed box
+        pushes_behind : dict mapping each move to neighbours[opposite move]
+        axes : the (neighbours['Left'], neighbours['Right']) and
+               (neighbours['Up'], neighbours['Down']) pairs
+        window_base : window_base[i] is the index in the deadlock pattern
+               database of the 3x3 window centred on cell i without boxes
+        windows : windows[i] is the list of the (cell id, increment) pairs
+               of the interior cells of that window, where increment is
+               added to the index when the cell holds a box
+        tunnels : dict mapping each move to a bytearray, tunnels[move][i] is
+               1 if cell i is not a target and a box pushed onto it in that
+               direction is in a one-wide corridor: the cell and the cell
+               behind it (where the worker stands) have walls on both sides
+        rooms : dict mapping (entrance, move) to the bitmask of a goal room,
+               an area of at most GOAL_ROOM_MAX_CELLS cells holding a
+               target that is cut off from the rest of the warehouse by
+               the entrance cell. A box pushed onto the entrance by that
+               move enters the room with its next push, and can't be pushed
+               back out, so it has to end on a target of the room.
+               See 'goal_room_plan'
+        target : bytearray, target[i] is 1 if cell i is a target
+        target_mask : int, bitmask of the ids of the targets
+        targets : list of the ids of the targets, in increasing order
+        push_distances : list of lists, push_distances[k][i] is the minimum
+               number of pushes needed to bring a box from cell i to target
+               targets[k], ignoring the other boxes, or -1 if it can't be done
+        dead : bytearray, dead[i] is 1 if no target can be reached by
+               pushing a box from cell i
+        taboo : the dead bytearray, the taboo cells of 'taboo_cells'
+    """
+
+    OUTSIDE, WALL, FLOOR, TARGET = range(4)
+
+    def __init__(self, warehouse):
         """
-        RULE 1: Check if a cell is a corner and not a target
+        @param warehouse: a valid Warehouse object
         """
-        wh = warehouse
-        for y in range(len(wh) - 1):  # Columns
-            inside = False  # Bool to check if inside or out
-            for x in range(len(wh[0]) - 1):  # Rows
-                if not inside:
-                    if wh[y][x] == wall:  # If we have reached the wall
-                        inside = True  # We are inside
-                else:
-                    if all([cell == ' ' for cell in wh[y][x:]]):
-                        break  # We are back ouside
-                    if wh[y][x] not in targets:  # Can't be taboo if it is a target
-                        if wh[y][x] != wall:  # Or a wall
-                            if corner(wh, x, y):
-                                wh[y][x] = taboo
-        return wh
-
-    def Rule2(warehouse):
-        """
-        RULE 2: Check if there are any target cells between two corners
-        """
-        wh = warehouse
-        for x in range(1, len(wh) - 1):  # Row
-            for y in range(1, len(wh[0]) - 1):  # Col
-                # Needs to be inline with a corner
-                if wh[x][y] == taboo and corner(wh, y, x):
-                    row = wh[x][y + 1:]
-                    col = [row[y] for row in wh[x + 1:][:]]
-                    for xin in range(len(row)):  # Inner row
-                        if row[xin] in targets or row[xin] == wall:
-                            break  # Can't be a target or be a wall
-                        if row[xin] == taboo and corner(wh, xin + y + 1, x):
-                            if all([corner(wh, xin2, x, 1)
-                                    for xin2 in range(y + 1, xin + y + 1)]):
-                                for xin3 in range(y + 1, xin + y + 1):
-                                    wh[x][xin3] = taboo
-                    for yin in range(len(col)):  # Inner col
-                        if col[yin] in targets or col[yin] == wall:
-                            break  # Can't be a target or be a wall
-                        if col[yin] == taboo and corner(wh, y, yin + x + 1):
-                            if all([corner(wh, y, yin2, 1)
-                                    for yin2 in range(x + 1, yin + x + 1)]):
-                                for yin3 in range(x + 1, yin + x + 1):
-                                    wh[yin3][y] = taboo
-        return wh
-
-    # convert warehouse to a string
-    wh_str = str(warehouse)
-
-    # Clean the string by removing the boxes and players
-    for cell in unwanted:  # If it is in list
-        wh_clean = wh_str.replace(cell, ' ')  # replace with a blank
-
-    # Rearange string to array to show full wh in 2D array
-    wh_array = [list(line) for line in wh_clean.split('\n')]
-
-    # Apply the 2 rules
-    wh_array = Rule1(wh_array)
-    wh_array = Rule2(wh_array)
-
-    # Convert back into a 1D string
-    wh_str = '\n'.join([''.join(line) for line in wh_array])
+        X, Y = zip(*warehouse.walls)
+        self.ncols, self.nrows = 1 + max(X), 1 + max(Y)
+        ncols, nrows = self.ncols, self.nrows
+        kind = bytearray([Board.FLOOR]) * (ncols * nrows)
+        for (x, y) in warehouse.walls:
+            kind[y * ncols + x] = Board.WALL
+        # flood the outside of the warehouse from the border of the grid
+        stack = [(x, y) for y in range(nrows) for x in range(ncols)
+                 if x in (0, ncols - 1) or y in (0, nrows - 1)]
+        while stack:
+            x, y = stack.pop()
+            if 0 <= x < ncols and 0 <= y < nrows and kind[y * ncols + x] == Board.FLOOR:
+                kind[y * ncols + x] = Board.OUTSIDE
+                stack.extend((x + dx, y + dy) for dx, dy in DIRECTIONS.values())
+        for (x, y) in warehouse.targets:
+            kind[y * ncols + x] = Board.TARGET
+        self.kind = kind
+
+        self.cells = [(x, y) for y in range(nrows) for x in range(ncols)
+                      if kind[y * ncols + x] in (Board.FLOOR, Board.TARGET)]
+        self.index = {cell: i for i, cell in enumerate(self.cells)}
+        self.neighbours = {
+            move: [self.index.get((x + dx, y + dy), -1) for (x, y) in self.cells]
+            for move, (dx, dy) in DIRECTIONS.items()}
+        self.moves = list(self.neighbours.items())
+        # (move, table ahead, table behind) for the pushes in each direction
+        self.pushes = [(move, self.neighbours[move], self.neighbours[back])
+                       for move, back in OPPOSITE.items()]
+        self.pushes_behind = {move: behind for move, _, behind in self.pushes}
+        self.axes = [(self.neighbours['Left'], self.neighbours['Right']),
+                     (self.neighbours['Up'], self.neighbours['Down'])]
+        self.target = bytearray(kind[y * ncols + x] == Board.TARGET
+                                for (x, y) in self.cells)
+        self.target_mask = sum(1 << i for i, t in enumerate(self.target) if t)
+        self.window_base, self.windows = [], []
+        for (x, y) in self.cells:
+            base, window = 0, []
+            for i in range(9):
+                cell = self.index.get((x + i % 3 - 1, y + i // 3 - 1), -1)
+                if cell < 0:
+                    base += PATTERN_WALL * 5 ** i
+                    continue
+                code = PATTERN_TARGET if self.target[cell] else PATTERN_FLOOR
+                base += code * 5 ** i
+                # a box turns FLOOR into BOX and TARGET into BOX_ON_TARGET
+                window.append((cell, (PATTERN_BOX - PATTERN_FLOOR) * 5 ** i))
+            self.window_base.append(base)
+            self.windows.append(window)
+        self.tunnels = {}
+        for move, _, behind in self.pushes:
+            side_a, side_b = self.axes[1 if move in ('Left', 'Right') else 0]
+            self.tunnels[move] = bytearray(
+                not self.target[i] and behind[i] >= 0
+                and side_a[i] < 0 and side_b[i] < 0
+                and side_a[behind[i]] < 0 and side_b[behind[i]] < 0
+                for i in range(len(self.cells)))
+        self.rooms = {}
+        for entrance in range(len(self.cells)):
+            for move, ahead, behind in self.pushes:
+                if ahead[entrance] < 0 or behind[entrance] < 0:
+                    continue
+                room = 0
+                dist = self.walk_distances(ahead[entrance], 1 << entrance)
+                for i, d in enumerate(dist):
+                    if d >= 0:
+                        room |= 1 << i
+                if (room >> behind[entrance] & 1 or not room & self.target_mask
+                        or bin(room).count('1') > GOAL_ROOM_MAX_CELLS):
+                    continue
+                # a box in the room can't be pushed back onto the entrance
+                if any(back[entrance] >= 0 and room >> back[entrance] & 1
+                       and back[back[entrance]] >= 0
+                       for _, _, back in self.pushes):
+                    continue
+                self.rooms[entrance, move] = room
+        # fill plans of the rooms, computed on demand by 'goal_room_plan'
+        self.goal_room_plans = {}
+        self.targets = [i for i, t in enumerate(self.target) if t]
+        self.push_distances = [self.pull_distances(t) for t in self.targets]
+        self.dead = bytearray(
+            d < 0 for d in self.pull_distances(*self.targets))
+        self.taboo = self.dead
+
+    def pull_distances(self, *targets):
+        """
+        Reverse "pull" breadth first search from targets: a box can be
+        pushed from cell p to its neighbour q if the cell on the other side
+        of p is free for the worker, so the search pulls the box from q back
+        to p. Other boxes are ignored. Each cell is visited once, whatever
+        the number of targets.
 
-    # Result
-    return wh_str
+        @param targets: ids of target cells
+
+        Return:
+            list indexed by cell id, minimum number of pushes to bring a
+            box from the cell to the nearest of the targets, -1 if it
+            can't be done
+        """
+        dist = [-1] * len(self.cells)
+        for target in targets:
+            dist[target] = 0
+        frontier = list(targets)
+        d = 0
+        while frontier:
+            d += 1
+            next_frontier = []
+            for q in frontier:
+                for _, _, behind in self.pushes:
+                    p = behind[q]  # where the box comes from
+                    if p >= 0 and dist[p] < 0 and behind[p] >= 0:
+                        dist[p] = d
+                        next_frontier.append(p)
+            frontier = next_frontier
+        return dist
+
+    def walk_distances(self, worker, blocked):
+        """
+        Breadth first flood fill of the cells the worker can walk to
+
+        @param worker: id of the cell of the worker
+
+        @param blocked: bitmask of the ids of the cells the worker cannot
+            enter (boxes)
+
+        Return:
+            list indexed by cell id, length of the shortest walk to the
+            cell or -1 if the worker cannot reach it
+        """
+        dist = [-1] * len(self.cells)
+        dist[worker] = 0
+        frontier = [worker]
+        tables = [table for _, table in self.moves]
+        d = 0
+        while frontier:
+            d += 1
+            next_frontier = []
+            for cell in frontier:
+                for table in tables:
+                    nxt = table[cell]
+                    if nxt >= 0 and dist[nxt] < 0 and not blocked >> nxt & 1:
+                        dist[nxt] = d
+                        next_frontier.append(nxt)
+            frontier = next_frontier
+        return dist
+
+    def walk(self, worker, goal, blocked):
+        """
+        Shortest walk of the worker to goal
+
+        @param worker: id of the cell of the worker
+
+        @param goal: id of the cell the worker must reach
+
+        @param blocked: bitmask of the ids of the cells the worker cannot
+            enter (boxes)
+
+        Return:
+            list of moves ('Up', 'Down', 'Left', 'Right'), None if goal
+            cannot be reached
+        """
+        parent = {worker: None}
+        frontier = collections.deque([worker])
+        while frontier:
+            cell = frontier.popleft()
+            if cell == goal:
+                path = []
+                while parent[cell] is not None:
+                    cell, move = parent[cell]
+                    path.append(move)
+                path.reverse()
+                return path
+            for move, table in self.moves:
+                nxt = table[cell]
+                if nxt >= 0 and nxt not in parent and not blocked >> nxt & 1:
+                    parent[nxt] = (cell, move)
+                    frontier.append(nxt)
+        return None
+
+    def room_fill(self, room, entrance, worker, others, target):
+        """
+        Reverse "pull" breadth first search that brings a box from a target
+        of a goal room back to the entrance, with the other boxes of the
+        room in place. The worker stays in the room, on the entrance or on
+        the cell it pushes from.
+
+        @param room: bitmask of the cells of the room (see Board.rooms)
+        @param entrance: id of the entrance cell
+        @param worker: id of the cell next to the entrance the worker
+            pushes the box onto the entrance from
+        @param others: bitmask of the cells of the room holding a box
+        @param target: id of a target of the room
+
+        Return:
+            the shortest tuple of moves that pushes a box from the entrance
+            onto the target (the worker starting on 'worker'), None if the
+            box can't be brought there
+        """
+        walkable = (room | 1 << entrance | 1 << worker) & ~others
+        free = (room | 1 << entrance) & ~others
+        parent = {}
+        frontier = collections.deque()
+        for _, table in self.moves:
+            w = table[target]
+            if w >= 0 and walkable >> w & 1:
+                parent[target, w] = None
+                frontier.append((target, w))
+        while frontier:
+            box, w = frontier.popleft()
+            if (box, w) == (entrance, worker):
+                state, path = (box, w), []
+                while parent[state] is not None:
+                    state, move = parent[state]
+                    path.append(move)
+                return tuple(path)
+            for move, ahead, behind in self.pushes:
+                # the worker steps back from w, the reverse of 'move'
+                nxt, nbox = behind[w], box
+                if nxt < 0 or nxt == box or not walkable >> nxt & 1:
+                    continue
+                if ahead[w] == box:  # pull the box onto w
+                    if not free >> w & 1:
+                        continue
+                    nbox = w
+                if (nbox, nxt) not in parent:
+                    parent[nbox, nxt] = ((box, w), move)
+                    frontier.append((nbox, nxt))
+        return None
+
+    def goal_room_plan(self, entrance, move):
+        """
+        Order in which the boxes pushed onto the entrance of a goal room
+        fill its targets, found backwards: starting from the full room, the
+        box of a target that can be brought back to the entrance with the
+        fewest moves is taken out, until the room is empty. Taking a box
+        out never blocks the others, so there is a plan if the room can be
+        filled one box at a time, and the plan is empty otherwise. Plans are cached in
+        self.goal_room_plans.
+
+        @param entrance, move: a key of Board.rooms
+
+        Return:
+            (room, plan) where room is the bitmask of the room and plan is
+            a dict mapping the bitmask of the boxes already in the room to
+            (target, moves), the next target to fill and the moves that
+            push the box from the entrance onto it (the worker starts on
+            the cell the box came from)
+        """
+        key = entrance, move
+        if key in self.goal_room_plans:
+            return self.goal_room_plans[key]
+        room = self.rooms[key]
+        worker = self.pushes_behind[move][entrance]
+        plan, filled = {}, room & self.target_mask
+        while filled:
+            best = None
+            for target in iter_bits(filled):
+                others = filled ^ 1 << target
+                moves = self.room_fill(room, entrance, worker, others, target)
+                if moves is not None and (best is None
+                                          or len(moves) < len(best[1])):
+                    best = target, moves
+            if best is None:  # some target can't be filled
+                plan = {}
+                break
+            filled ^= 1 << best[0]
+            plan[filled] = best
+        self.goal_room_plans[key] = room, plan
+        return room, plan
+
+
+_boards = collections.OrderedDict()
+
+
+def layout_digest(warehouse):
+    """
+    @param warehouse: a valid Warehouse object
+
+    Return:
+        hex digest of the walls and targets of the warehouse, shared by
+        all the warehouses with the same layout whatever their boxes,
+        weights and worker
+    """
+    layout = repr((sorted(warehouse.walls), sorted(warehouse.targets)))
+    return hashlib.sha1(layout.encode()).hexdigest()
+
+
+def compile_board(warehouse):
+    """
+    Return the Board of the layout of warehouse. Boards are cached by
+    layout digest (see 'layout_digest'), so all the warehouses (and copies)
+    that share a layout share one Board. At most BOARD_CACHE_SIZE Boards
+    are kept in memory. If BOARD_CACHE_DIR is set, the Boards are also
+    saved there and loaded back by later processes; a file that can't be
+    read is ignored and rebuilt.
+
+    The Board is also memoized on the warehouse itself (with the lists of
+    its walls and targets), so looking it up again for the same warehouse
+    doesn't compute the digest; a warehouse whose walls or targets are
+    replaced by other lists is looked up again.
+
+    @param warehouse: a valid Warehouse object
+    """
+    memo = getattr(warehouse, '_board', None)
+    if (memo is not None and memo[0] is warehouse.walls
+            and memo[1] is warehouse.targets):
+        return memo[2]
+    key = layout_digest(warehouse)
+    board = _boards.get(key)
+    if board is not None:
+        _boards.move_to_end(key)
+        warehouse._board = warehouse.walls, warehouse.targets, board
+        return board
+    path = None
+    if BOARD_CACHE_DIR:
+        path = os.path.join(BOARD_CACHE_DIR, 'board-{}-v{}.pickle'.format(
+            key, BOARD_CACHE_VERSION))
+        try:
+            with open(path, 'rb') as f:
+                board = pickle.load(f)
+        except (OSError, ValueError, pickle.UnpicklingError, EOFError,
+                AttributeError, ImportError):
+            board = None
+    if not isinstance(board, Board):
+        board = Board(warehouse)
+        if path is not None:
+            try:
+                os.makedirs(BOARD_CACHE_DIR, exist_ok=True)
+                # write then rename, so other processes never see a partial file
+                tmp = '{}.{}.tmp'.format(path, os.getpid())
+                with open(tmp, 'wb') as f:
+                    pickle.dump(board, f, pickle.HIGHEST_PROTOCOL)
+                os.replace(tmp, path)
+            except OSError:
+                pass  # the cache directory is only an optimisation
+    _boards[key] = board
+    if len(_boards) > BOARD_CACHE_SIZE:
+        _boards.popitem(last=False)
+    warehouse._board = warehouse.walls, warehouse.targets, board
+    return board
+
+
+def load_pattern_db(path=PATTERN_DB_PATH):
+    """
+    Memory-map the deadlock pattern database written by build_deadlock_db.py
+
+    @param path: path of the database
+
+    Return:
+        the read-only mmap of the file, or None if the file is missing or
+        is not a pattern database
+    """
+    try:
+        with open(path, 'rb') as f:
+            db = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):  # missing or empty file
+        return None
+    if (len(db) != len(PATTERN_DB_MAGIC) + (5 ** 9 + 7) // 8
+            or db[:len(PATTERN_DB_MAGIC)] != PATTERN_DB_MAGIC):
+        db.close()
+        return None
+    return db
+
+
+pattern_db = load_pattern_db()
 
 # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 
@@ -164,54 +576,368 @@ class SokobanPuzzle(search.Problem):
     Your implementation should be fully compatible with the search functions of
     the provided module 'search.py'.
 
+    By default a state is a pair (boxes, worker) where boxes is the tuple of
+    the (x, y) coordinates of the boxes (in the order of warehouse.weights)
+    and worker the (x, y) coordinate of the worker.
+    With compact=True a state is a 'BitState' (bitmasks of cell ids, see
+    BitState) that carries its Zobrist hash; 'successor' updates the hash
+    incrementally from the Zobrist keys of the puzzle.
+    Use 'encode', 'decode' and 'to_warehouse' to convert between states and
+    the Warehouse representation.
+
+    With tunnels=True, a push that leaves a box in a tunnel (see
+    Board.tunnels) goes on pushing it to the end of the tunnel, and with
+    goal_rooms=True, a push onto the entrance of a goal room (see
+    Board.rooms) goes on pushing the box onto the next target of the room.
+    Such a macro action is the tuple of the elementary actions it stands
+    for. Use 'step_actions' to expand them.
+
     """
 
-    def __init__(self, warehouse):
+    def __init__(self, warehouse, compact=False, tunnels=False,
+                 goal_rooms=False):
 
         """
         Initialises the variables used for the Problem Solver
 
         @param warehouse: The chosen warehouse
 
+        @param compact: if True, use the bitmask state representation
+
+        @param tunnels: if True, push boxes through tunnels in one action.
+            The intermediate states are skipped, but the walking cost of
+            the solution found is no longer guaranteed minimal.
+
+        @param goal_rooms: if True, push the boxes that enter a goal room
+            onto its targets in one action, in the order of
+            Board.goal_room_plan. The solution found may cost more than
+            the minimum.
+
         Return:
         None
         """
         # Check there are enough targets for all boxes
         assert len(warehouse.targets) >= len(warehouse.boxes)
-        self.initial = tuple(warehouse.boxes), tuple(warehouse.worker)
         self.problem = warehouse
-        self.taboo = taboo_calc(warehouse)
+        self.compact = compact
+        self.tunnels = tunnels
+        self.goal_rooms = goal_rooms
+        self.board = compile_board(warehouse)
+        # boxes of the same weight can be swapped without changing the puzzle
+        self.interchangeable = len(set(warehouse.weights)) < len(warehouse.weights)
+        self.weight_classes = sorted(set(warehouse.weights))
+        # Zobrist keys of a box of each weight class and of the worker on
+        # each cell, same seed in every process
+        rng = random.Random(ZOBRIST_SEED)
+        self.ncells = ncells = len(self.board.cells)
+        self.zobrist_boxes = [[rng.getrandbits(63) for _ in range(ncells)]
+                              for _ in self.weight_classes]
+        self.zobrist_worker = [rng.getrandbits(63) for _ in range(ncells)]
+        # rows of the cost matrix of 'h', by (cell id, weight) of the box
+        self.cost_rows = {}
+        # number of pushes pruned by 'actions', by reason ('taboo',
+        # 'pattern', 'freeze', 'corral')
+        self.pruned = collections.Counter()
+        self.initial = self.encode(warehouse.boxes, warehouse.worker,
+                                   warehouse.weights)
+
+    def encode(self, boxes, worker, weights):
+        """
+        @param boxes: sequence of the (x, y) coordinates of the boxes
+        @param worker: (x, y) coordinate of the worker
+        @param weights: sequence of the weights of the boxes
 
-    def actions(self, state):
+        Return:
+         The state of this puzzle for the given boxes and worker
         """
-        @param state: The current state
+        if not self.compact:
+            return tuple(boxes), tuple(worker)
+        index = self.board.index
+        masks = [0] * len(self.weight_classes)
+        worker = index[tuple(worker)]
+        zobrist = self.zobrist_worker[worker]
+        for box, weight in zip(boxes, weights):
+            k, cell = self.weight_classes.index(weight), index[tuple(box)]
+            masks[k] |= 1 << cell
+            zobrist ^= self.zobrist_boxes[k][cell]
+        return BitState(tuple(masks), worker, zobrist)
+
+    def decode(self, state):
+        """
+        @param state: a state of the puzzle
 
         Return:
-         The list of actions that can be executed in the given state.
+         (boxes, weights, worker) where boxes is the list of the (x, y)
+         coordinates of the boxes, weights the list of their weights and
+         worker the (x, y) coordinate of the worker
+        """
+        if not self.compact:
+            return list(state[0]), list(self.problem.weights), state[1]
+        cells = self.board.cells
+        boxes, weights = [], []
+        for weight, mask in zip(self.weight_classes, state.masks):
+            for cell in iter_bits(mask):
+                boxes.append(cells[cell])
+                weights.append(weight)
+        return boxes, weights, cells[state.worker]
+
+    def box_cells(self, state):
+        """
+        @param state: a state of the puzzle
 
+        Return:
+         The list of the (cell id, weight) pairs of the boxes
         """
-        # list of actions that can be taken
-        L = []  
+        if self.compact:
+            return [(cell, weight)
+                    for weight, mask in zip(self.weight_classes, state.masks)
+                    for cell in iter_bits(mask)]
+        index = self.board.index
+        return [(index[box], weight)
+                for box, weight in zip(state[0], self.problem.weights)]
+
+    def moved_box(self, state1, state2):
+        """
+        @param state1: a state of the puzzle
+        @param state2: a state obtained from state1 by 'successor'
+
+        Return:
+         (src, dst), the ids of the cells the pushed box moved from and to,
+         or None if no box moved
+        """
+        if self.compact:
+            if state1.masks is state2.masks:
+                return None
+            for old, new in zip(state1.masks, state2.masks):
+                if old != new:
+                    return ((old & ~new).bit_length() - 1,
+                            (new & ~old).bit_length() - 1)
+        if state1[0] is state2[0]:
+            return None
+        index = self.board.index
+        for old, new in zip(state1[0], state2[0]):
+            if old != new:
+                return index[old], index[new]
+
+    def cost_row(self, box, weight):
+        """
+        @param box: id of the cell of a box
+        @param weight: weight of the box
+
+        Return:
+         The list of the costs of pushing the box to each target (see 'h'),
+         shared between all the calls with the same arguments
+        """
+        row = self.cost_rows.get((box, weight))
+        if row is None:
+            row = self.cost_rows[box, weight] = [
+                dist[box] * (1 + weight) if dist[box] >= 0 else UNREACHABLE
+                for dist in self.board.push_distances]
+        return row
+
+    def to_warehouse(self, state):
+        """
+        @param state: a state of the puzzle
 
-        # Nested If statement that checks if each action
-        # is possible to execute for the worker
+        Return:
+         A copy of the warehouse of the puzzle with the boxes, their
+         weights and the worker of the given state
+        """
+        boxes, weights, worker = self.decode(state)
+        return self.problem.copy(worker=worker, boxes=boxes, weights=weights)
 
-        if legal_check(self.problem, state, 'Up') != 'Impossible':
-            if taboo_check(self.taboo, state, 'Up') != 'taboo':
-                L.append('Up')
+    def occupancy(self, state):
+        """
+        @param state: a state of the puzzle
 
-        if legal_check(self.problem, state, 'Down') != 'Impossible':
-            if taboo_check(self.taboo, state, 'Down') != 'taboo':
-                L.append('Down')
+        Return:
+         (boxes, worker) where boxes is the bitmask of the ids of the cells
+         holding a box and worker is the id of the cell of the worker
+        """
+        if self.compact:
+            boxes = 0
+            for mask in state.masks:
+                boxes |= mask
+            return boxes, state.worker
+        index = self.board.index
+        boxes = 0
+        for box in state[0]:
+            boxes |= 1 << index[box]
+        return boxes, index[state[1]]
+
+    def weight_at(self, state, cell):
+        """
+        @param state: a state of the puzzle
+        @param cell: id of a cell
 
-        if legal_check(self.problem, state, 'Left') != 'Impossible':
-            if taboo_check(self.taboo, state, 'Left') != 'taboo':
-                L.append('Left')
-                
-        if legal_check(self.problem, state, 'Right') != 'Impossible':
-            if taboo_check(self.taboo, state, 'Right') != 'taboo':
-                L.append('Right')
+        Return:
+         The weight of the box on the cell, None if there is no box
+        """
+        if self.compact:
+            for weight, mask in zip(self.weight_classes, state.masks):
+                if mask >> cell & 1:
+                    return weight
+            return None
+        boxes, box = state[0], self.board.cells[cell]
+        if box in boxes:
+            return self.problem.weights[boxes.index(box)]
+        return None
+
+    def successor(self, state, worker, src=None, dst=None):
+        """
+        @param state: a state of the puzzle
+        @param worker: id of the cell the worker moves to
+        @param src: id of the cell of the box to move, None if no box moves
+        @param dst: id of the cell the box moves to
 
+        Return:
+         The state after the moves of the worker and of the box. If no box
+         moves, the boxes part of the state is shared with 'state'.
+        """
+        cells = self.board.cells
+        if self.compact:
+            masks = state.masks
+            zobrist = (state.zobrist ^ self.zobrist_worker[state.worker]
+                       ^ self.zobrist_worker[worker])
+            if src is not None:
+                for k, mask in enumerate(masks):
+                    if mask >> src & 1:
+                        masks = (masks[:k] + (mask ^ (1 << src | 1 << dst),)
+                                 + masks[k + 1:])
+                        keys = self.zobrist_boxes[k]
+                        zobrist ^= keys[src] ^ keys[dst]
+                        break
+            return BitState(masks, worker, zobrist)
+        boxes = state[0]
+        if src is not None:
+            i = boxes.index(cells[src])
+            boxes = boxes[:i] + (cells[dst],) + boxes[i + 1:]
+        return boxes, cells[worker]
+
+    def pattern_deadlock(self, occupied, box):
+        """
+        Look up the 3x3 window centred on a box that was just pushed in the
+        deadlock pattern database (see build_deadlock_db.py)
+
+        @param occupied: bitmask of the cells holding a box after the push
+        @param box: id of the cell of the pushed box
+
+        Return:
+         True if the window is a known deadlock, False if it is not or if
+         there is no database
+        """
+        if pattern_db is None:
+            return False
+        board = self.board
+        index = board.window_base[box]
+        for cell, increment in board.windows[box]:
+            if occupied >> cell & 1:
+                index += increment
+        return bool(pattern_db[len(PATTERN_DB_MAGIC) + (index >> 3)]
+                    >> (index & 7) & 1)
+
+    def freeze_deadlock(self, occupied, box):
+        """
+        Check if a box that was just pushed is frozen off target.
+
+        A box is blocked along an axis if one of its neighbours on that axis
+        is a wall, if both are taboo cells, or if one is a frozen box (the
+        boxes already being checked count as walls). A box is frozen if it
+        is blocked along both axes. Only the pushed box and the boxes
+        frozen together with it are examined.
+
+        @param occupied: bitmask of the cells holding a box after the push
+        @param box: id of the cell of the pushed box
+
+        Return:
+         True if the box is frozen and some box frozen with it (or itself)
+         is not on a target, so the puzzle can't be solved any more
+        """
+        board = self.board
+        taboo = board.taboo
+        frozen = []  # boxes found frozen, in the order they were proven
+
+        def is_frozen(cell, walls):
+            walls |= 1 << cell
+            start = len(frozen)
+            for before, after in board.axes:
+                a, b = before[cell], after[cell]
+                if a < 0 or b < 0 or walls >> a & 1 or walls >> b & 1:
+                    continue  # against a wall
+                if taboo[a] and taboo[b]:
+                    continue  # can only be pushed onto taboo cells
+                if occupied >> a & 1 and is_frozen(a, walls):
+                    continue
+                if occupied >> b & 1 and is_frozen(b, walls):
+                    continue
+                del frozen[start:]
+                return False
+            frozen.append(cell)
+            return True
+
+        if not is_frozen(box, 0):
+            return False
+        target = board.target
+        return not all(target[cell] for cell in frozen)
+
+    def actions(self, state):
+        """
+        @param state: The current state
+
+        Return:
+         The list of actions that can be executed in the given state.
+         Pushes onto a taboo cell, into a known deadlock pattern or into a
+         freeze deadlock (see 'pattern_deadlock' and 'freeze_deadlock') are
+         left out and counted in self.pruned. With tunnels or goal_rooms
+         set, the pushes that start a macro (see SokobanPuzzle) are
+         replaced by the tuple of the moves of the macro.
+
+        """
+        occupied, w = self.occupancy(state)
+        board = self.board
+        taboo = board.taboo
+
+        # list of actions that can be taken
+        L = []
+        for move, table in self.board.moves:
+            ahead = table[w]
+            if ahead < 0:  # wall
+                continue
+            if occupied >> ahead & 1:  # push
+                beyond = table[ahead]
+                # Can't push into a wall or another box
+                if beyond < 0 or occupied >> beyond & 1:
+                    continue
+                if taboo[beyond]:
+                    self.pruned['taboo'] += 1
+                    continue
+                macro = (move,)
+                if self.tunnels:
+                    # the worker can only back off, push on to the end
+                    tunnel = board.tunnels[move]
+                    while tunnel[beyond]:
+                        nxt = table[beyond]
+                        if nxt < 0 or occupied >> nxt & 1 or taboo[nxt]:
+                            break
+                        beyond = nxt
+                        macro += (move,)
+                if self.goal_rooms and (beyond, move) in board.rooms:
+                    room, plan = board.goal_room_plan(beyond, move)
+                    fill = plan.get(occupied & room)
+                    if fill is not None:
+                        beyond, moves = fill
+                        macro += moves
+                pushed = occupied ^ (1 << ahead | 1 << beyond)
+                if self.pattern_deadlock(pushed, beyond):
+                    self.pruned['pattern'] += 1
+                    continue
+                if self.freeze_deadlock(pushed, beyond):
+                    self.pruned['freeze'] += 1
+                    continue
+                if len(macro) > 1:
+                    L.append(macro)
+                    continue
+            L.append(move)
         return L
 
     def result(self, state, action):
@@ -224,10 +950,39 @@ class SokobanPuzzle(search.Problem):
          action in the given state. The action must be one of
          self.actions(state).
         """
+        if isinstance(action, tuple):  # macro
+            worker, src, dst, _ = self.macro_push(state, action)
+            return self.successor(state, worker, src, dst)
+        occupied, w = self.occupancy(state)
+        table = self.board.neighbours[action]
+        ahead = table[w]
+        if occupied >> ahead & 1:  # push the box
+            return self.successor(state, ahead, ahead, table[ahead])
+        return self.successor(state, ahead)
+
+    def macro_push(self, state, action):
+        """
+        Replay a macro action, a tuple of moves that starts with a push and
+        only moves that one box.
 
-        next_state = state
-        next_state = make_move(next_state, action)
-        return tuple(next_state)
+        @param state: a state of the puzzle
+        @param action: a macro action of self.actions(state)
+
+        Return:
+         (worker, src, dst, pushes), the ids of the cells of the worker
+         after the macro and of the box before and after it, and the
+         number of pushes of the box
+        """
+        neighbours = self.board.neighbours
+        w = self.occupancy(state)[1]
+        src = dst = neighbours[action[0]][w]
+        pushes = 0
+        for move in action:
+            w = neighbours[move][w]
+            if w == dst:
+                dst = neighbours[move][dst]
+                pushes += 1
+        return w, src, dst, pushes
 
     def goal_test(self, state):
         """
@@ -237,11 +992,59 @@ class SokobanPuzzle(search.Problem):
         Return:
          True if all boxes in warehouse are on a target.
         """
+        if self.compact:
+            occupied, _ = self.occupancy(state)
+            return not occupied & ~self.board.target_mask
         boxes = state[0]
         if (set(boxes).issubset(set(self.problem.targets))):
             return True
         return False
 
+    def state_key(self, state):
+        """
+        @param state: a state of the puzzle
+
+        Return:
+         The key of the state for the explored set and the frontier.
+         States that only differ by a permutation of boxes of equal
+         weight get the same key, as they have the same solutions at
+         the same cost. Compact states are already in that form; their
+         key is packed into an int (see 'pack').
+        """
+        if self.compact:
+            return self.pack(state)
+        if self.interchangeable:
+            boxes, worker = state
+            return tuple(sorted(zip(self.problem.weights, boxes))), worker
+        return state
+
+    def pack(self, state, worker=None):
+        """
+        @param state: a compact state (see BitState)
+        @param worker: id of the cell of the worker, if not state.worker
+
+        Return:
+         The int made of the bits of the worker, of each mask in turn
+         (ncells bits each) and of the Zobrist hash of the state (63 bits).
+         Two compact states are equal if and only if they pack to the same
+         int, which takes a fraction of the memory of a BitState with its
+         masks and hash, so it is the key of the compact states in the
+         explored set of a search. The hash of an int is its value modulo a
+         prime, so with the Zobrist hash in the low bits the keys spread
+         evenly over the slots of a table (ida_star_search) or over the
+         workers of a parallel search.
+        """
+        zobrist = state.zobrist
+        if worker is None:
+            worker = state.worker
+        else:
+            zobrist ^= (self.zobrist_worker[state.worker]
+                        ^ self.zobrist_worker[worker])
+        key = worker
+        for mask in state.masks:
+            key = key << self.ncells | mask
+        return key << 63 | zobrist
+
     def path_cost(self, c, state1, action, state2):
         """
         Path_cost provides the path cost from one state to another based on an action list
@@ -258,58 +1061,114 @@ class SokobanPuzzle(search.Problem):
           state2.  If the path does matter, it will consider c and maybe state1
           and action. The default method costs 1 for every step in the path."""
 
-        boxes_old = state1[0]
-        boxes_new = state2[0]
-        counter = 0
+        # each move of a macro costs 1, each push the weight of the box
+        if isinstance(action, tuple):
+            _, box, _, pushes = self.macro_push(state1, action)
+            return c + len(action) + pushes * self.weight_at(state1, box)
 
         # Added for each action
         if action:
             c = c + 1
 
-        assert len(boxes_old) == len(boxes_new)
+        # No box moved ('successor' shares the boxes part)
+        if self.compact:
+            if state1.masks is state2.masks:
+                return c
+            worker = state2.worker
+        else:
+            if state1[0] is state2[0]:
+                return c
+            worker = self.board.index[state2[1]]
 
-        #While loop counting the movement of each box from old to new
-        while counter < len(boxes_old):
-            diff = manhattan(boxes_old[counter], boxes_new[counter])
+        # A pushed box was where the worker now stands
+        weight = self.weight_at(state1, worker)
+        if weight is not None:
+            c = c + weight
 
-            # If statement to determine once a box_old has reached box_new
-            if diff > 0:
-                weight = self.problem.weights[counter]
-                box_push = diff * weight
-                c = c + box_push
-            counter = counter + 1
-        
         #returns path cost
         return c
 
+    def step_actions(self, actions):
+        """
+        Expand the macro actions of a solution into elementary actions.
+
+        @param actions: a list of actions returned by a search on this
+            puzzle
+
+        Return:
+            The equivalent list of 'Left', 'Right', 'Up', 'Down' actions
+        """
+        steps = []
+        for action in actions:
+            if isinstance(action, tuple):
+                steps.extend(action)
+            else:
+                steps.append(action)
+        return steps
+
     def h(self, n):
         """
         Heuristic for goal state; the estimated movement cost
 
-        The Heuristic uses the Manhattan distance formula to
-        calcuate the distance between the box and their targets,
-        as well as the distance between worker and the boxes.
+        The boxes are assigned to distinct targets by a minimum cost
+        matching (see 'min_cost_assignment') where moving a box of weight w
+        to a target costs at least its push distance (see
+        Board.push_distances) times (1 + w). If the boxes can't all reach
+        distinct targets the state is a deadlock and h is infinite.
+        Before its first push the worker has to walk next to a box, so the
+        distance between the worker and the nearest box (minus one) is
+        added when some box is not on a target.
+
+        The matching is cached on the node (n.cache) and a child inherits
+        the matching of its parent: it is reused as is if no box moved, and
+        only the row of the pushed box is replaced and re-matched otherwise
+        (see 'moved_box' and 'min_cost_assignment'). Right after a push the
+        worker is next to the pushed box, so the worker term is only
+        recomputed after a plain move.
 
         @param n: n parameter
 
         Returns:
             Int representing the estimated remaining cost to reach goal state from current state
         """
-        boxes = list(n.state[0])
-        targets = list(self.problem.targets)
-        worker = list(n.state[1])
-        weight = zip(n.state[0], self.problem.weights)
+        parent = getattr(n.parent, 'cache', None)
+        moved = None
+        if parent is None:
+            boxes, weights = [], []
+            for box, weight in self.box_cells(n.state):
+                boxes.append(box)
+                weights.append(weight)
+            cost = [self.cost_row(box, weight)
+                    for box, weight in zip(boxes, weights)]
+            n.cache = (boxes, weights, cost) + min_cost_assignment(cost)
+        else:
+            moved = self.moved_box(n.parent.state, n.state)
+            if moved is None:
+                n.cache = parent
+            else:
+                boxes, weights, cost, _, previous = parent
+                src, dst = moved
+                i = boxes.index(src)
+                boxes, cost = list(boxes), list(cost)
+                boxes[i] = dst
+                cost[i] = self.cost_row(dst, weights[i])
+                n.cache = ((boxes, weights, cost)
+                              + min_cost_assignment(cost, previous, i))
 
         # Variable for the sum of the distance
-        dist_sum = 0 
-
-        # Calculating the distance between the targets and the boxes with there weights
-        for box, weight in weight:
-            b_t = [manhattan(box, target) for target, target in enumerate(targets)]
-            dist_sum = dist_sum + min(b_t) + (min(b_t)*weight)
+        dist_sum = n.cache[3]
+        if dist_sum == 0:  # all the boxes are on targets
+            return 0
+        if dist_sum >= UNREACHABLE:  # some box can't reach a free target
+            return float('inf')
+        if moved is not None:  # the worker is next to the pushed box
+            return dist_sum
 
         # Calculates the distance from the worker and the boxes
-        w_b = [manhattan(worker, box) for box, box in enumerate(boxes)]
+        cells = self.board.cells
+        x, y = cells[n.state.worker] if self.compact else n.state[1]
+        w_b = [abs(x - cells[box][0]) + abs(y - cells[box][1])
+               for box in n.cache[0]]
         dist_sum = dist_sum + min(w_b) - 1
 
         # returns the final value from the total distances
@@ -318,54 +1177,592 @@ class SokobanPuzzle(search.Problem):
 
 # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 
-def manhattan(co_1, co_2):
+
+class SokobanMacroPuzzle(SokobanPuzzle):
     """
-    Calcualtes manhattan distance between two coordiante tuples
-   
-    @param co_1: first coordinate tuple 
+    Push-level formulation of a Sokoban puzzle.
+
+    The states are the same as for 'SokobanPuzzle', but an action is a box
+    push ((x, y), move) where (x, y) is the box and move is one of 'Up',
+    'Down', 'Left', 'Right'. The worker walks (along a shortest path) to the
+    cell behind the box and pushes it once, so the states where the worker
+    merely wanders around are never put on the frontier.
+
+    The cost of an action is the length of the walk plus the cost of the push,
+    so the path cost of a solution is the same as for the equivalent sequence
+    of elementary actions. Use 'step_actions' to expand a solution back into
+    elementary actions.
+
+    A corral is a connected area of free cells the worker can't reach,
+    fenced by walls and boxes. A PI-corral is a corral whose boxes can only
+    be pushed into the corral, and where the worker can reach every such
+    push. States with a PI-corral that a small sub-search proves unsolvable
+    are pruned (see 'corral_deadlock').
+    """
+
+    def __init__(self, warehouse, collapse_regions=False, compact=False,
+                 pi_corrals=False):
+        """
+        Initialises the variables used for the Problem Solver
 
-    @param co_2: second coordinate tuple 
+        @param warehouse: The chosen warehouse
 
-    Return:
-        Absolute distance between two coordinates    
+        @param collapse_regions: if True, states with the same boxes and the
+            worker in the same connected region share their key (see
+            'state_key'). This shrinks the explored set, but the walking
+            cost of the solution found is no longer guaranteed minimal.
+
+        @param compact: if True, use the bitmask state representation
+
+        @param pi_corrals: if True, only the pushes of the boxes of a
+            PI-corral are generated when the state has one. Some box of the
+            corral has to be pushed before the puzzle is solved, so the
+            puzzle stays solvable, but the walking cost of the solution
+            found is no longer guaranteed minimal.
+        """
+        super().__init__(warehouse, compact)
+        self.collapse_regions = collapse_regions
+        self.pi_corrals = pi_corrals
+        # results of 'corral_deadlock', by (boxes of the corral, top-left
+        # cell of the region of the worker without the other boxes)
+        self.corral_deadlocks = {}
+        # worker distances of the last state passed to 'actions'
+        # 'path_cost' is called for the children of that same state
+        self._reach_state, self._reach = None, None
+
+    def reach(self, state):
+        """
+        @param state: a state of the puzzle
+
+        Return:
+            A list indexed by cell id (see Board) giving the length of the
+            shortest walk of the worker to the cell without pushing a box,
+            or -1 if the worker cannot reach the cell.
+        """
+        if state is not self._reach_state:
+            self._reach = self.board.walk_distances(*self.occupancy(state)[::-1])
+            self._reach_state = state
+        return self._reach
+
+    def corrals(self, occupied, reach):
+        """
+        @param occupied: bitmask of the cells holding a box
+        @param reach: worker distances of the state (see 'reach')
+
+        Return:
+            The list of the (area, boxes) bitmasks of the corrals of the
+            state: area is a connected set of free cells the worker can't
+            reach and boxes are the boxes next to it.
+        """
+        tables = [table for _, table in self.board.moves]
+        seen = 0
+        corrals = []
+        for start, d in enumerate(reach):
+            if d >= 0 or occupied >> start & 1 or seen >> start & 1:
+                continue
+            seen |= 1 << start
+            area, boxes = 0, 0
+            stack = [start]
+            while stack:
+                cell = stack.pop()
+                area |= 1 << cell
+                for table in tables:
+                    nxt = table[cell]
+                    if nxt < 0:
+                        continue
+                    if occupied >> nxt & 1:
+                        boxes |= 1 << nxt
+                    elif not seen >> nxt & 1:
+                        seen |= 1 << nxt
+                        stack.append(nxt)
+            if boxes:  # not a pocket sealed by walls
+                corrals.append((area, boxes))
+        return corrals
+
+    def is_pi_corral(self, occupied, reach, area, boxes):
+        """
+        @param occupied: bitmask of the cells holding a box
+        @param reach: worker distances of the state (see 'reach')
+        @param area, boxes: a corral of the state (see 'corrals')
+
+        Return:
+            True if the corral still has to be solved (a box off target or
+            an empty target inside), every legal push of its boxes by the
+            worker from outside goes into the area, and the worker can
+            reach all these pushes
+        """
+        board = self.board
+        if not (boxes & ~board.target_mask or area & board.target_mask):
+            return False
+        taboo = board.taboo
+        for b in iter_bits(boxes):
+            for _, ahead, behind in board.pushes:
+                a, w = ahead[b], behind[b]
+                if (a < 0 or w < 0 or occupied >> a & 1 or occupied >> w & 1
+                        or area >> w & 1 or taboo[a]):
+                    continue
+                if reach[w] < 0 or not area >> a & 1:
+                    return False
+        return True
+
+    def corral_deadlock(self, worker, area, boxes):
+        """
+        Try to prove that a corral can't be solved.
+
+        All the boxes but those of the corral are removed and a breadth
+        first search over the pushes of the remaining boxes looks for a
+        state where they are all on targets or where the worker can enter
+        the area. The other boxes only get in the way, so if there is no
+        such state the corral is a deadlock. The search gives up (and
+        returns False) after CORRAL_SEARCH_LIMIT states. Results are cached
+        in self.corral_deadlocks.
+
+        @param worker: id of the cell of the worker
+        @param area, boxes: a corral (see 'corrals')
+
+        Return:
+            True if the corral is proven to be a deadlock
+        """
+        board = self.board
+        taboo, target_mask = board.taboo, board.target_mask
+
+        def region(worker, boxes):
+            dist = board.walk_distances(worker, boxes)
+            top = next(i for i, d in enumerate(dist) if d >= 0)
+            return dist, top
+
+        dist, top = region(worker, boxes)
+        key = boxes, top
+        if key in self.corral_deadlocks:
+            return self.corral_deadlocks[key]
+
+        seen = {key}
+        frontier = collections.deque([(boxes, dist)])
+        deadlock = True
+        while frontier and deadlock:
+            boxes, dist = frontier.popleft()
+            for b in iter_bits(boxes):
+                for _, ahead, behind in board.pushes:
+                    a, w = ahead[b], behind[b]
+                    if (a < 0 or w < 0 or dist[w] < 0 or boxes >> a & 1
+                            or taboo[a]):
+                        continue
+                    pushed = boxes ^ (1 << b | 1 << a)
+                    if self.freeze_deadlock(pushed, a):
+                        continue
+                    next_dist, next_top = region(b, pushed)
+                    if (pushed, next_top) in seen:
+                        continue
+                    if not pushed & ~target_mask or any(
+                            next_dist[cell] >= 0 for cell in iter_bits(area)):
+                        deadlock = False
+                        break
+                    if len(seen) >= CORRAL_SEARCH_LIMIT:
+                        deadlock = False
+                        break
+                    seen.add((pushed, next_top))
+                    frontier.append((pushed, next_dist))
+                if not deadlock:
+                    break
+        self.corral_deadlocks[key] = deadlock
+        return deadlock
+
+    def actions(self, state):
+        """
+        @param state: The current state
+
+        Return:
+            The list of pushes ((x, y), move) the worker can reach and
+            perform in the given state without pushing a box onto a
+            taboo cell, into a known deadlock pattern or into a freeze
+            deadlock (counted in self.pruned).
+            There is none if a PI-corral of the state is a deadlock, and
+            only the pushes of the boxes of the smallest PI-corral are
+            listed if pi_corrals is set.
+        """
+        occupied, worker = self.occupancy(state)
+        cells, taboo = self.board.cells, self.board.taboo
+        reach = self.reach(state)
+        movable = occupied
+        for area, boxes in self.corrals(occupied, reach):
+            if not self.is_pi_corral(occupied, reach, area, boxes):
+                continue
+            if self.corral_deadlock(worker, area, boxes):
+                self.pruned['corral'] += 1
+                return []
+            if self.pi_corrals and bin(boxes).count('1') < bin(movable).count('1'):
+                movable = boxes
+        L = []
+        for b in iter_bits(movable):
+            for move, ahead, behind in self.board.pushes:
+                a, w = ahead[b], behind[b]
+                if (a < 0 or w < 0 or reach[w] < 0 or occupied >> a & 1):
+                    continue
+                pushed = occupied ^ (1 << b | 1 << a)
+                if taboo[a]:
+                    self.pruned['taboo'] += 1
+                elif self.pattern_deadlock(pushed, a):
+                    self.pruned['pattern'] += 1
+                elif self.freeze_deadlock(pushed, a):
+                    self.pruned['freeze'] += 1
+                else:
+                    L.append((cells[b], move))
+        return L
+
+    def result(self, state, action):
+        """
+        @param state: The current state of the warehouse
+        @param action: a push ((x, y), move)
+
+        Return:
+            The state after the push. The worker stands where the box was.
+        """
+        box, move = action
+        b = self.board.index[box]
+        return self.successor(state, b, b, self.board.neighbours[move][b])
+
+    def path_cost(self, c, state1, action, state2):
+        """
+        @param c: The current cost of the state
+        @param state1: The curent state of the warehouse
+        @param action: a push ((x, y), move)
+        @param state2: The state after the push
+
+        Return:
+            c plus the length of the walk to the pushing position plus
+            the cost of the push (1 + weight of the pushed box).
+        """
+        box, move = action
+        b = self.board.index[box]
+        walk = self.reach(state1)[self.board.pushes_behind[move][b]]
+        return c + walk + 1 + self.weight_at(state1, b)
+
+    def state_key(self, state):
+        """
+        @param state: a state of the puzzle
+
+        Return:
+            The key of 'SokobanPuzzle.state_key'. If collapse_regions is
+            set, the worker is replaced by the top-left-most cell of its
+            reachable region, so that all the positions from which the
+            worker can perform the same pushes share one key.
+        """
+        key = super().state_key(state)
+        if self.collapse_regions:
+            occupied, w = self.occupancy(state)
+            dist = self.board.walk_distances(w, occupied)
+            # cell ids are in reading order
+            worker = next(i for i, d in enumerate(dist) if d >= 0)
+            if self.compact:
+                return self.pack(state, worker)
+            return key[0], self.board.cells[worker]
+        return key
+
+    def step_actions(self, macro_actions):
+        """
+        Expand a sequence of pushes into elementary actions.
+
+        @param macro_actions: a list of pushes returned by a search on
+            this puzzle, starting from the initial state
+
+        Return:
+            The equivalent list of 'Left', 'Right', 'Up', 'Down' actions
+        """
+        state = self.initial
+        steps = []
+        for action in macro_actions:
+            box, move = action
+            occupied, w = self.occupancy(state)
+            behind = self.board.pushes_behind[move][self.board.index[box]]
+            steps.extend(self.board.walk(w, behind, occupied))
+            steps.append(move)
+            state = self.result(state, action)
+        return steps
+
+
+class SokobanPullPuzzle(SokobanMacroPuzzle):
+    """
+    Reverse formulation of a Sokoban puzzle, searched backwards from the
+    solved warehouse by 'solve_bidirectional_sokoban'.
+
+    The states are compact states (see BitState) and their keys are those
+    of a SokobanMacroPuzzle with collapse_regions set, so a state of this
+    puzzle and a state of the push search of the same warehouse share
+    their key when they have the same boxes and the worker in the same
+    region.
+
+    'initial' is the list of the goal states: each placement of the boxes
+    on the targets (at most GOAL_PLACEMENT_LIMIT of them) with the worker
+    in each region of the free cells.
+    An action is a pull ((x, y), move): the worker walks next to the box at
+    (x, y), on its side in direction move, then steps once more in that
+    direction and the box follows. It costs as much as the push that
+    undoes it. Use 'push_actions' to turn the pulls of a path into the
+    pushes that bring the boxes back.
     """
 
-    manhattan = (abs(co_1[0] - co_2[0]) +
-                 abs(co_1[1] - co_2[1]))
-    return manhattan
+    def __init__(self, warehouse):
+        """
+        @param warehouse: The chosen warehouse
+        """
+        super().__init__(warehouse, collapse_regions=True, compact=True)
+        board = self.board
+        # cells a box of the warehouse can be pushed to, ignoring the
+        # other boxes; a box pulled anywhere else can't be put back
+        self.reachable = bytearray(len(board.cells))
+        stack = [board.index[box] for box in warehouse.boxes]
+        while stack:
+            cell = stack.pop()
+            if self.reachable[cell]:
+                continue
+            self.reachable[cell] = 1
+            for _, ahead, behind in board.pushes:
+                if ahead[cell] >= 0 and behind[cell] >= 0:
+                    stack.append(ahead[cell])
+        self.initial = self.goal_states(warehouse.weights)
+
+    def goal_states(self, weights):
+        """
+        @param weights: sequence of the weights of the boxes
+
+        Return:
+            The list of the states with all the boxes on targets and the
+            worker on the top-left-most cell of a region of free cells,
+            for the first GOAL_PLACEMENT_LIMIT placements of the boxes
+        """
+        board = self.board
+        counts = collections.Counter(weights)
+
+        def placements(k, free):
+            # masks of the weight classes k, k+1, ... on the free targets
+            if k == len(self.weight_classes):
+                yield ()
+                return
+            for chosen in itertools.combinations(
+                    free, counts[self.weight_classes[k]]):
+                mask = sum(1 << t for t in chosen)
+                for rest in placements(k + 1, [t for t in free
+                                               if t not in chosen]):
+                    yield (mask,) + rest
+
+        states = []
+        for masks in itertools.islice(placements(0, board.targets),
+                                      GOAL_PLACEMENT_LIMIT):
+            occupied, zobrist = 0, 0
+            for keys, mask in zip(self.zobrist_boxes, masks):
+                occupied |= mask
+                for cell in iter_bits(mask):
+                    zobrist ^= keys[cell]
+            seen = occupied
+            for worker in range(len(board.cells)):  # reading order
+                if seen >> worker & 1:
+                    continue
+                for cell, d in enumerate(board.walk_distances(worker, occupied)):
+                    if d >= 0:
+                        seen |= 1 << cell
+                states.append(BitState(masks, worker,
+                                       zobrist ^ self.zobrist_worker[worker]))
+        return states
+
+    def actions(self, state):
+        """
+        @param state: The current state
+
+        Return:
+            The list of pulls ((x, y), move) the worker can reach and
+            perform in the given state without pulling a box onto a cell
+            no box of the warehouse can be pushed to.
+        """
+        occupied, _ = self.occupancy(state)
+        cells, reachable = self.board.cells, self.reachable
+        reach = self.reach(state)
+        L = []
+        for b in iter_bits(occupied):
+            for move, ahead, _ in self.board.pushes:
+                a = ahead[b]
+                if a < 0 or reach[a] < 0 or not reachable[a]:
+                    continue
+                w = ahead[a]
+                if w >= 0 and not occupied >> w & 1:
+                    L.append((cells[b], move))
+        return L
+
+    def result(self, state, action):
+        """
+        @param state: The current state of the warehouse
+        @param action: a pull ((x, y), move)
+
+        Return:
+            The state after the pull. The box stands where the worker was.
+        """
+        box, move = action
+        b = self.board.index[box]
+        ahead = self.board.neighbours[move]
+        return self.successor(state, ahead[ahead[b]], b, ahead[b])
+
+    def path_cost(self, c, state1, action, state2):
+        """
+        @param c: The current cost of the state
+        @param state1: The curent state of the warehouse
+        @param action: a pull ((x, y), move)
+        @param state2: The state after the pull
+
+        Return:
+            c plus the length of the walk to the pulling position plus
+            the cost of the pull (1 + weight of the pulled box).
+        """
+        box, move = action
+        b = self.board.index[box]
+        walk = self.reach(state1)[self.board.neighbours[move][b]]
+        return c + walk + 1 + self.weight_at(state1, b)
+
+    def h(self, n):
+        """
+        No heuristic, the pull search is a uniform cost search.
+        """
+        return 0
+
+    def push_actions(self, pulls):
+        """
+        @param pulls: the pulls of a path of this puzzle
+
+        Return:
+            The list of the pushes ((x, y), move) that undo them, last
+            pull first
+        """
+        cells, index = self.board.cells, self.board.index
+        return [(cells[self.board.neighbours[move][index[box]]], OPPOSITE[move])
+                for box, move in reversed(pulls)]
+
 
 # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 
 
-def calculate_move(state, move):
+class BitState:
+    """
+    Compact state of a SokobanPuzzle built with compact=True.
+
+    'worker' is the id of the cell of the worker (see Board) and 'masks' is a
+    tuple with one int bitmask per box weight (in the order of the
+    weight_classes of the puzzle): bit i of masks[k] is set if cell i holds
+    a box of weight weight_classes[k]. Boxes of equal weight are therefore
+    interchangeable and a BitState is canonical.
+
+    'zobrist' is the XOR of the Zobrist keys of the boxes and of the worker.
+    It is maintained incrementally by SokobanPuzzle.successor and is the
+    hash of the state, so sets and dicts of states never rehash the boxes.
+    Equality compares the full state, so hash collisions are harmless.
+    """
+
+    __slots__ = ('masks', 'worker', 'zobrist')
+
+    def __init__(self, masks, worker, zobrist):
+        self.masks = masks
+        self.worker = worker
+        self.zobrist = zobrist
+
+    def __hash__(self):
+        return self.zobrist
+
+    def __eq__(self, other):
+        # compare the hashes first, most unequal states differ there
+        return (isinstance(other, BitState) and self.zobrist == other.zobrist
+                and self.worker == other.worker and self.masks == other.masks)
+
+    def __lt__(self, other):
+        if self.masks != other.masks:
+            return self.masks < other.masks
+        return self.worker < other.worker
+
+    def __repr__(self):
+        return "BitState({}, {})".format(self.masks, self.worker)
+
+
+def iter_bits(mask):
     """
-    Calculates the tiles to consider in the direction of a given move ('Up', 'Down', 'Left', 'Right')
+    Yield the indices of the set bits of mask, lowest first
 
-    @param State: The current state of the warehouse
-    @param move: The next move of the worker
+    @param mask: a non-negative int (e.g. a bitmask of cell ids)
+    """
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask ^= low
 
-    Return:
-        explore_titles provides the tile one step ahead
-        explore_more provides the tile two steps ahead 
+
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+
+def min_cost_assignment(cost, previous=None, changed=None):
     """
-    worker = state[1]
-    coordinate_change = (0, 0)
-    if move == 'Up':
-        coordinate_change = (0, -1)
-    elif move == 'Down':
-        coordinate_change = (0, 1)
-    elif move == 'Left':
-        coordinate_change = (-1, 0)
-    elif move == 'Right':
-        coordinate_change = (1, 0)
+    Minimum cost assignment of the rows of a cost matrix to distinct
+    columns (Hungarian algorithm with shortest augmenting paths, O(n^2 m)).
 
-    explore_tile = (worker[0] + coordinate_change[0],
-                    worker[1] + coordinate_change[1])  # One tile ahead
+    @param cost: list of n rows of m >= n costs
 
-    explore_more = (explore_tile[0] + coordinate_change[0],
-                    explore_tile[1] + coordinate_change[1])  # One tile further ahead
+    @param previous: optional matching returned by a previous call on a
+        square matrix that only differs from cost on row 'changed'. The
+        row is then unmatched and re-matched with a single augmenting
+        path, in O(n^2) instead of O(n^3).
 
-    return explore_tile, explore_more
+    @param changed: index of the row that changed since 'previous'
+
+    Return:
+        (total, matching) where total is the minimum total cost and
+        matching is a triple (p, u, v) of lists: p[j] is the row
+        (1-based) matched to column j (1-based), u and v are the
+        potentials of the rows and of the columns.
+    """
+    n = len(cost)
+    m = len(cost[0]) if n else 0
+    if previous is not None and n == m:
+        p, u, v = list(previous[0]), list(previous[1]), list(previous[2])
+        i = changed + 1
+        p[p.index(i, 1)] = 0  # free the column of the changed row
+        u[i] = 0
+        rows = (i,)
+    else:
+        p, u, v = [0] * (m + 1), [0] * (n + 1), [0] * (m + 1)
+        rows = range(1, n + 1)
+
+    inf = float('inf')
+    for i in rows:
+        # grow a shortest augmenting path from row i to a free column
+        p[0] = i
+        j0 = 0
+        minv = [inf] * (m + 1)
+        used = [False] * (m + 1)
+        way = [0] * (m + 1)
+        while True:
+            used[j0] = True
+            i0 = p[j0]
+            row, ui0 = cost[i0 - 1], u[i0]
+            delta, j1 = inf, 0
+            for j in range(1, m + 1):
+                if not used[j]:
+                    cur = row[j - 1] - ui0 - v[j]
+                    if cur < minv[j]:
+                        minv[j] = cur
+                        way[j] = j0
+                    if minv[j] < delta:
+                        delta, j1 = minv[j], j
+            for j in range(m + 1):
+                if used[j]:
+                    u[p[j]] += delta
+                    v[j] -= delta
+                else:
+                    minv[j] -= delta
+            j0 = j1
+            if p[j0] == 0:
+                break
+        # flip the augmenting path
+        while j0:
+            j1 = way[j0]
+            p[j0] = p[j1]
+            j0 = j1
+
+    total = sum(cost[p[j] - 1][j - 1] for j in range(1, m + 1) if p[j])
+    return total, (p, u, v)
 
 # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 
@@ -374,47 +1771,71 @@ def taboo_calc(warehouse):
     """
     finds coordinates of taboo cells in warehouse
 
+    @param warehouse: a valid Warehouse object, or a string returned by
+        taboo_cells
+
     @param return: returns list of tuple coordinates of taboo cell locations in warehouse e.g. [(3,5), (7,2), (8,4)]
     """
-    wh = taboo_cells(warehouse)
-    lines = wh.split(sep="\n")
-
-    return list(sokoban.find_2D_iterator(lines, "X"))
+    if isinstance(warehouse, str):
+        lines = warehouse.split(sep="\n")
+        return list(sokoban.find_2D_iterator(lines, "X"))
+    board = compile_board(warehouse)
+    # cell ids are in reading order, like the cells of find_2D_iterator
+    return [cell for cell, dead in zip(board.cells, board.dead) if dead]
 
 # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 
 
-def taboo_check(taboo_locations, state, move):
+def box_positions(board, state):
+    """
+    @param board: the Board of the warehouse of state (see 'compile_board')
+
+    @param state: a state (boxes, worker) of the warehouse, with the (x, y)
+        coordinates of the boxes and of the worker
+
+    Return:
+        dict mapping the cell id of each box to its position in state[0]:
+        built once per state, it lets taboo_check, legal_check and make_move
+        find the box on a cell in constant time
+    """
+    index = board.index
+    return {index[tuple(box)]: i for i, box in enumerate(state[0])}
+
+
+def taboo_check(warehouse, state, move, board=None, boxes_at=None):
     """
     checks if given move pushes box into taboo cell
 
-    @param tabboo_locations: coordiantes of taboo cells e.g. [(3,5), (7,2), (8,4)]
+    @param warehouse: a valid Warehouse object
 
     @param state: current state of problem
 
     @param move: move to be executed from given state
 
-    @param return: 'tabboo' if moving box into tabboo cell
+    @param board: the Board of warehouse (see 'compile_board'), looked up if
+           None; pass it when checking many moves of one warehouse
+
+    @param boxes_at: box_positions(board, state), built if None
+
+    @param return: 'taboo' if moving box into taboo cell
     """
-    explore_tile, explore_more = calculate_move(state, move)
-    boxes = state[0]
-    t_l = taboo_locations
-    
-    # For all boxes in current state, if any (boxes) are on the first tile infront of the worker, add to list of obstrucitons
-    obstruction_close = [element for element,
-                         element in enumerate(boxes) if element == explore_tile]
-
-    # If box where worker wants to go                     
-    if len(obstruction_close) != 0:  
-        
-        # if pushing box into taboo cell
-        if binary_tuple_search(explore_more, t_l) != -1:
-            return 'tabboo'
+    if board is None:
+        board = compile_board(warehouse)
+    if boxes_at is None:
+        boxes_at = box_positions(board, state)
+    table = board.neighbours[move]
+
+    explore_tile = table[board.index[tuple(state[1])]]  # One tile ahead
+    # If box where worker wants to go and pushing it into taboo cell
+    if explore_tile in boxes_at:
+        explore_more = table[explore_tile]  # 2 tiles in front
+        if explore_more >= 0 and board.taboo[explore_more]:
+            return 'taboo'
 
 
 # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 
-def legal_check(warehouse, state, move):
+def legal_check(warehouse, state, move, board=None, boxes_at=None):
     """
     Checks if given move is legal in given state
 
@@ -429,81 +1850,63 @@ def legal_check(warehouse, state, move):
 
     @param move: a move to check
 
-    @param return: 'Impossible' if move does not satisfy all legal conditions
-    """
-
-    explore_tile, explore_more = calculate_move(state, move)
-    boxes = state[0]
+    @param board: the Board of warehouse (see 'compile_board'), looked up if
+           None; pass it when checking many moves of one warehouse
 
-    # For all boxes in current state, if any (boxes) are on the first tile
-    #  infront of the worker, add to list of obstrucitons
-    push = [element for element, element in enumerate(
-        boxes) if element == explore_tile]
-    push_into = [element for element, element in enumerate(
-        boxes) if element == explore_more]  # 2 tiles in front
+    @param boxes_at: box_positions(board, state), built if None
 
-    if binary_tuple_search(explore_tile, warehouse.walls) != -1:  # If wall
+    @param return: 'Impossible' if move does not satisfy all legal conditions
+    """
+    if board is None:
+        board = compile_board(warehouse)
+    if boxes_at is None:
+        boxes_at = box_positions(board, state)
+    table = board.neighbours[move]
+
+    explore_tile = table[board.index[tuple(state[1])]]  # One tile ahead
+    if explore_tile < 0:  # If wall
         return 'Impossible'
 
-    if len(push) != 0:  # If box
+    if explore_tile in boxes_at:  # If box
+        explore_more = table[explore_tile]  # 2 tiles in front
         # If wall OR box
-        if binary_tuple_search(explore_more, warehouse.walls) != -1 or len(push_into) != 0:
+        if explore_more < 0 or explore_more in boxes_at:
             return 'Impossible'
 
 # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 
 
-def make_move(state, move):
+def make_move(warehouse, state, move, board=None, boxes_at=None):
     """
     Makes an already checked legal move in a given state
 
-    @param state: a state of a problem
-
-    @param move: a valid move
-    """
-    explore_tile, explore_more = calculate_move(state, move)
-    worker = list(state[1])
-    boxes = list(state[0])
-
-    # For all boxes in current state, if any (boxes) are on the first tile infront of
-    # the worker, add to list of obstrucitons # Check if tile in front of worker has box on it
-
-    push = [(element, i) for i, element in enumerate(boxes) if element == explore_tile]
+    @param warehouse: a valid Warehouse object
 
-    # If box in front of worker
-    if len(push) != 0:
-        boxes[push[0][1]] = explore_more # Push box
-        
-    worker = explore_tile  # Move worker forward
-    return tuple(boxes), tuple(worker)
+    @param state: a state of the warehouse object
 
+    @param move: a valid move
 
-# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+    @param board: the Board of warehouse (see 'compile_board'), looked up if
+           None; pass it when making many moves of one warehouse
 
+    @param boxes_at: box_positions(board, state), built if None
 
-def binary_tuple_search(target, list):
+    Return:
+        the state after the move, the boxes in the same order
     """
-    WARNING: ONLY USE FOR STATIC SORTED LISTS (E.G. WALLS, TARGETS)
-
-    Binary Tuple Search (More efficiently searches for a given tuple in a large, sorted list of tuples such as walls)
-
-    @param target: a coordinate tuple E.g. (4,0)
+    if board is None:
+        board = compile_board(warehouse)
+    if boxes_at is None:
+        boxes_at = box_positions(board, state)
+    cells, table = board.cells, board.neighbours[move]
+    boxes = state[0]
 
-    @param list: a sorted list of coordinate tuples E.g. [(2,0),(3,0),(4,0),(0,1),(1,1)]
+    explore_tile = table[board.index[tuple(state[1])]]  # One tile ahead
+    i = boxes_at.get(explore_tile)
+    if i is not None:  # If box in front of worker, push it
+        boxes = boxes[:i] + (cells[table[explore_tile]],) + boxes[i + 1:]
+    return tuple(boxes), cells[explore_tile]  # Move worker forward
 
-    @return: index of target in list, -1 if not present
-    """
-    l = 0
-    r = len(list) - 1
-    while l <= r:
-        m = (l + r) // 2
-        if target == list[m]:
-            return m
-        elif target[::-1] > list[m][::-1]:
-            l = m + 1
-        else:
-            r = m - 1
-    return -1
 
 # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 
@@ -530,14 +1933,16 @@ def check_elem_action_seq(warehouse, action_seq):
                the sequence of actions.  This must be the same string as the
                string returned by the method  Warehouse.__str__()
     """
+    board = compile_board(warehouse)  # once, not once per move
     state = tuple(warehouse.boxes), tuple(warehouse.worker)
     for move in action_seq:
-        if legal_check(warehouse, state, move) == 'Impossible':
+        boxes_at = box_positions(board, state)  # once per state
+        if legal_check(warehouse, state, move, board, boxes_at) == 'Impossible':
             return 'Impossible'
         else:
-            new_state = make_move(state, move)
-            warehouse.boxes = new_state[0]
-            warehouse.worker = new_state[1]
+            state = make_move(warehouse, state, move, board, boxes_at)
+            warehouse.boxes = list(state[0])
+            warehouse.worker = state[1]
 
     # Return string representing state of warehouse after applying sequence of actions
     return warehouse.__str__()
@@ -548,14 +1953,32 @@ def check_elem_action_seq(warehouse, action_seq):
 def trace_path(node):
     path = []
     while node.parent:
-        path.insert(0, node.action)  # insert at index 0 (start)
+        path.append(node.action)  # from the end, reversed below
         node = node.parent
+    path.reverse()
     return path  # ['Left', 'Down', Down','Right', 'Up', 'Down']
 
 # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 
 
-def solve_weighted_sokoban(warehouse):
+def make_puzzle(warehouse, macro=False, compact=False, tunnels=False,
+                goal_rooms=False):
+    """
+    @param warehouse: a valid Warehouse object
+    @param macro, compact, tunnels, goal_rooms: see solve_weighted_sokoban
+
+    Return:
+        The SokobanMacroPuzzle (if macro is set) or SokobanPuzzle to search
+    """
+    if macro:
+        return SokobanMacroPuzzle(warehouse, compact=compact)
+    return SokobanPuzzle(warehouse, compact=compact, tunnels=tunnels,
+                         goal_rooms=goal_rooms)
+
+
+def solve_weighted_sokoban(warehouse, macro=False, compact=False,
+                           tunnels=False, goal_rooms=False, method='astar',
+                           processes=None, stats=None):
     """
     This function analyses the given warehouse.
     It returns the two items. The first item is an action sequence solution.
@@ -564,6 +1987,53 @@ def solve_weighted_sokoban(warehouse):
     @param
      warehouse: a valid Warehouse object
 
+    @param
+     macro: if True, search over box pushes (SokobanMacroPuzzle) instead
+            of elementary actions. The solution is expanded back into
+            elementary actions before it is returned.
+
+    @param
+     compact: if True, search with the bitmask state representation
+              (see SokobanPuzzle)
+
+    @param
+     tunnels: if True and macro is False, push boxes through tunnels in
+              one action (see SokobanPuzzle). The cost of the solution
+              found may then be above the minimum.
+
+    @param
+     goal_rooms: if True and macro is False, push the boxes that enter a
+              goal room onto its targets in one action (see SokobanPuzzle).
+              The cost of the solution found may then be above the minimum.
+
+    @param
+     method: the search algorithm, 'astar' for search.astar_graph_search
+             or 'ida' for search.ida_star_search, which only keeps the
+             current path and a transposition table of bounded size in
+             memory, or 'hda' for search.hash_distributed_astar_search,
+             which shares the states out between worker processes. All
+             three return a solution of minimum cost.
+             'bidirectional' uses solve_bidirectional_sokoban, which
+             ignores macro, compact, tunnels and goal_rooms and does not
+             guarantee the minimum cost. 'portfolio' races the optimal
+             configurations of PORTFOLIO in parallel (see
+             solve_weighted_sokoban_portfolio) and ignores the other
+             arguments.
+
+    @param
+     processes: number of worker processes of the 'hda' method, by default
+                one per CPU
+
+    @param
+     stats: if a dict is given, it is filled with the statistics of the
+            search (see search.SearchStats.as_dict: 'expanded',
+            'generated', 'duplicates', 'pruned', 'max_frontier',
+            'max_explored', 'elapsed' and 'nodes_per_second') and
+            'deadlocks', the counts of the pushes pruned by the puzzle by
+            reason (see SokobanPuzzle.actions). It is left empty by the
+            'portfolio' method, and 'deadlocks' is empty for 'hda', whose
+            puzzles live in other processes.
+
     @return
 
         If puzzle cannot be solved
@@ -577,10 +2047,32 @@ def solve_weighted_sokoban(warehouse):
             If the puzzle is already in a goal state, simply return []
             C is the total cost of the action sequence C
     """
-    sp = SokobanPuzzle(warehouse)
-    sol_ts = search.astar_graph_search(sp)  # graph search version
+    if method == 'bidirectional':
+        return solve_bidirectional_sokoban(warehouse, stats)
+    if method == 'portfolio':
+        return solve_weighted_sokoban_portfolio(warehouse)[:2]
+    sp = make_puzzle(warehouse, macro, compact, tunnels, goal_rooms)
+    search_stats = None if stats is None else search.SearchStats()
+    # only pass stats when asked for, so the default call also works with
+    # the original search.py, whose searches take no stats argument
+    kwargs = {} if stats is None else {'stats': search_stats}
+    if method == 'ida':
+        # memory-bounded version
+        sol_ts = search.ida_star_search(sp, **kwargs)
+    elif method == 'astar':
+        # graph search version
+        sol_ts = search.astar_graph_search(sp, **kwargs)
+    elif method == 'hda':
+        sol_ts = search.hash_distributed_astar_search(sp, processes,
+                                                      **kwargs)
+    else:
+        raise ValueError("method must be one of 'astar', 'ida', 'hda', "
+                         "'bidirectional' or 'portfolio'.")
+    if stats is not None:
+        stats.update(search_stats.as_dict(), deadlocks=dict(sp.pruned))
     if sol_ts:
         S = trace_path(sol_ts)  # trace path to solution node
+        S = sp.step_actions(S)  # macro actions -> elementary actions
         C = sol_ts.path_cost
 
         # check_elem_action_seq(sp.problem, action_seq)
@@ -588,6 +2080,207 @@ def solve_weighted_sokoban(warehouse):
     return "impossible", None
 
 
+def solve_weighted_sokoban_anytime(warehouse, time_limit=2.0, node_limit=None,
+                                   weights=(5, 3, 2, 1.5, 1.25, 1),
+                                   macro=False, compact=False, tunnels=False,
+                                   goal_rooms=False):
+    """
+    Anytime version of solve_weighted_sokoban: search with
+    search.anytime_weighted_astar_search, which finds a first solution
+    quickly with a large heuristic weight and then improves it with the
+    smaller weights until it is proven optimal or the budget runs out.
+
+    @param
+     warehouse: a valid Warehouse object
+
+    @param
+     time_limit: wall-clock budget of the search in seconds, None for no
+                 limit
+
+    @param
+     node_limit: maximum number of expanded nodes, None for no limit
+
+    @param
+     weights: decreasing heuristic weights of the successive searches
+
+    @param
+     macro, compact, tunnels, goal_rooms: see solve_weighted_sokoban
+
+    @return
+        (S, C, bound) for the best solution found, where S and C are as
+        for solve_weighted_sokoban and C is at most bound times the
+        minimum cost (bound is 1 if S is optimal).
+        ('impossible', None, None) if the puzzle has no solution, and
+        (None, None, None) if the budget ran out before a solution was
+        found.
+    """
+    sp = make_puzzle(warehouse, macro, compact, tunnels, goal_rooms)
+    solution = None
+    for solution in search.anytime_weighted_astar_search(
+            sp, weights=weights, time_limit=time_limit, node_limit=node_limit):
+        pass
+    if solution is None:
+        return "impossible", None, None
+    sol_ts, bound = solution
+    if sol_ts is None:  # out of budget
+        return None, None, None
+    S = sp.step_actions(trace_path(sol_ts))
+    return S, sol_ts.path_cost, bound
+
+
+def solve_bidirectional_sokoban(warehouse, stats=None):
+    """
+    Solve the warehouse with search.bidirectional_search: a push search
+    (SokobanMacroPuzzle) from the warehouse meets a pull search
+    (SokobanPullPuzzle) from the goal placements of the boxes. Both
+    searches collapse the worker to its region, so they meet on the same
+    boxes with the worker in the same region. The pushes of the forward
+    half, followed by the pushes that undo the pulls of the backward half,
+    are expanded into elementary actions.
+
+    The solution is not guaranteed to be of minimum cost.
+
+    @param
+     warehouse: a valid Warehouse object
+
+    @param
+     stats: see solve_weighted_sokoban, 'deadlocks' adds up the counts
+            of the two puzzles
+
+    @return
+        as for solve_weighted_sokoban. C is the cost of S, replayed from
+        the warehouse (the walks of the two halves don't join up, so their
+        path costs don't add up to it).
+    """
+    forward = SokobanMacroPuzzle(warehouse, collapse_regions=True, compact=True)
+    backward = SokobanPullPuzzle(warehouse)
+    search_stats = None if stats is None else search.SearchStats()
+    meeting = search.bidirectional_search(forward, backward,
+                                          stats=search_stats)
+    if stats is not None:
+        stats.update(search_stats.as_dict(),
+                     deadlocks=dict(forward.pruned + backward.pruned))
+    if meeting is None:
+        return "impossible", None
+    node_f, node_b = meeting
+    pushes = trace_path(node_f)
+    if node_b is not None:
+        pushes += backward.push_actions(trace_path(node_b))
+    S = forward.step_actions(pushes)
+    sp = SokobanPuzzle(warehouse, compact=True)
+    state, C = sp.initial, 0
+    for action in S:
+        next_state = sp.result(state, action)
+        C = sp.path_cost(C, state, action, next_state)
+        state = next_state
+    return S, C
+
+
+def is_optimal(config):
+    """
+    @param config: keyword arguments of solve_weighted_sokoban
+
+    Return:
+        True if solve_weighted_sokoban is guaranteed to return a solution
+        of minimum cost with these arguments
+    """
+    return (config.get('method', 'astar') in ('astar', 'ida', 'hda')
+            and (config.get('macro') or not (config.get('tunnels')
+                                             or config.get('goal_rooms'))))
+
+
+def portfolio_member(job):
+    """
+    Solve a warehouse with one configuration of a portfolio, in a worker
+    process of solve_weighted_sokoban_portfolio.
+
+    @param job: (i, warehouse, config)
+
+    Return:
+        (i, S, C, None) where S, C = solve_weighted_sokoban(warehouse,
+        **config), or (i, None, None, error) if it raised an exception,
+        error being its description (the exception itself may not be
+        picklable)
+    """
+    i, warehouse, config = job
+    try:
+        S, C = solve_weighted_sokoban(warehouse, **config)
+    except Exception as e:  # MemoryError included
+        return i, None, None, '{}: {}'.format(type(e).__name__, e)
+    return i, S, C, None
+
+
+def solve_weighted_sokoban_portfolio(warehouse, configs=PORTFOLIO,
+                                     optimal=True, processes=None,
+                                     time_limit=None):
+    """
+    Race several configurations of solve_weighted_sokoban on the warehouse,
+    one per process of a multiprocessing pool. The first configuration to
+    finish wins and the pool is terminated, killing the others. A
+    configuration that fails (raises an exception, runs out of memory...)
+    drops out of the race without stopping the others.
+
+    @param
+     warehouse: a valid Warehouse object
+
+    @param
+     configs: sequence of dicts of keyword arguments of
+              solve_weighted_sokoban (see PORTFOLIO). The methods that start
+              processes of their own ('hda' and 'portfolio') can't be
+              members: the workers of the pool are daemonic processes,
+              which are not allowed to have children
+
+    @param
+     optimal: if True, only the configurations that guarantee a solution
+              of minimum cost (see is_optimal) are raced
+
+    @param
+     processes: size of the pool, by default one process per configuration
+                up to the number of CPUs
+
+    @param
+     time_limit: wall-clock budget in seconds, None for no limit
+
+    @return
+        (S, C, config) where S, C is the result of the winning
+        configuration config (('impossible', None) if the puzzle has no
+        solution), or (None, None, None) if the budget ran out.
+        Raises RuntimeError if every configuration failed.
+    """
+    for config in configs:
+        if config.get('method') in ('hda', 'portfolio'):
+            raise ValueError("method '{}' can't be a member of a portfolio."
+                             .format(config['method']))
+    configs = [config for config in configs
+               if not optimal or is_optimal(config)]
+    if not configs:
+        raise ValueError("no configuration of the portfolio is optimal.")
+    if processes is None:
+        processes = min(len(configs), os.cpu_count() or 1)
+    deadline = None if time_limit is None else time.time() + time_limit
+    pool = multiprocessing.Pool(processes)
+    try:
+        results = pool.imap_unordered(
+            portfolio_member,
+            [(i, warehouse, config) for i, config in enumerate(configs)])
+        errors = []
+        for _ in configs:
+            timeout = (None if deadline is None
+                       else max(0, deadline - time.time()))
+            try:
+                i, S, C, error = results.next(timeout=timeout)
+            except multiprocessing.TimeoutError:
+                return None, None, None
+            if error is None:
+                return S, C, configs[i]
+            errors.append('{}: {}'.format(configs[i], error))
+        raise RuntimeError("every configuration of the portfolio failed: "
+                           + '; '.join(errors))
+    finally:
+        pool.terminate()
+        pool.join()
+
+
 # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 
 
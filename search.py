@@ -29,10 +29,15 @@ import sys
 # check the Python version is at least 3.5
 assert sys.version_info >= (3, 5)
 
+import array
 import collections  # for dequeue
 import functools
 import heapq
 import itertools
+import multiprocessing
+import os
+import queue
+import time
 
 
 def memoize(fn, slot=None, maxsize=128):
@@ -59,6 +64,7 @@ def memoize(fn, slot=None, maxsize=128):
 # Queues: Stack, FIFOQueue, PriorityQueue
 # Stack and FIFOQueue are implemented as list and collection.deque
 # PriorityQueue is implemented here
+# All three index their items so that 'item in q' does not scan the queue
 
 
 class Queue:
@@ -82,22 +88,62 @@ class Queue:
         for item in items: self.append(item)
 
 
-def LIFOQueue():
+class _MemberIndex:
     """
-    Return an empty list, suitable as a Last-In-First-Out Queue.
+    Mixin for the list based queues. It keeps a companion multiset of the
+    queued items so that 'item in q' is a hash lookup instead of a linear
+    scan. Only the Queue methods (append, extend, pop) keep the multiset
+    up to date.
+    """
+
+    def _index_add(self, item):
+        self.members[item] = self.members.get(item, 0) + 1
+
+    def _index_discard(self, item):
+        count = self.members[item]
+        if count == 1:
+            del self.members[item]
+        else:
+            self.members[item] = count - 1
+
+    def extend(self, items):
+        for item in items: self.append(item)
+
+    def __contains__(self, item):
+        return item in self.members
+
+
+class LIFOQueue(_MemberIndex, list):
+    """
+    A Last-In-First-Out Queue, implemented as a list.
     Last-In-First-Out Queues are also called stacks
     """
-    return []
+    def __init__(self):
+        list.__init__(self)
+        self.members = {}
+    def append(self, item):
+        list.append(self, item)
+        self._index_add(item)
+    def pop(self):
+        item = list.pop(self)
+        self._index_discard(item)
+        return item
 
 
-class FIFOQueue(collections.deque):
+class FIFOQueue(_MemberIndex, collections.deque):
     """
     A First-In-First-Out Queue.
     """
     def __init__(self):
         collections.deque.__init__(self)
+        self.members = {}
+    def append(self, item):
+        collections.deque.append(self, item)
+        self._index_add(item)
     def pop(self):
-        return self.popleft()
+        item = self.popleft()
+        self._index_discard(item)
+        return item
 
 
 # ______________________________________________________________________________
@@ -110,10 +156,18 @@ class PriorityQueue:
     order) is returned first.
     If order is 'min', the item with minimum f(x) is
     returned first; if order is 'max', then it is the item with maximum f(x).
-    Also supports dict-like lookup."""
+    Also supports dict-like lookup.
+
+    Each queued item is indexed by a dictionary that maps it to its heap
+    entry, so membership tests and f-value lookups are O(1) and replacing
+    an item is O(log n). Deleted entries are not removed from the heap
+    straight away; they are marked as stale and skipped when popped
+    (lazy invalidation). The queue holds at most one entry per item:
+    appending an item equal to a queued one replaces the queued one."""
 
     def __init__(self, order='min', f=lambda x: x):
-        self.heap = []
+        self.heap = []  # heap of [f(item), item, live] entries
+        self.index = {}  # item -> its live entry in self.heap
         if order == 'min':
             self.f = f
         elif order == 'max':  # now item with max f(x)
@@ -123,7 +177,11 @@ class PriorityQueue:
 
     def append(self, item):
         """Insert item at its correct position."""
-        heapq.heappush(self.heap, (self.f(item), item))
+        if item in self.index:
+            del self[item]
+        entry = [self.f(item), item, True]
+        self.index[item] = entry
+        heapq.heappush(self.heap, entry)
 
     def extend(self, items):
         """Insert each item in items at its correct position."""
@@ -133,34 +191,41 @@ class PriorityQueue:
     def pop(self):
         """Pop and return the item (with min or max f(x) value)
         depending on the order."""
-        if self.heap:
-            return heapq.heappop(self.heap)[1]
-        else:
-            raise Exception('Trying to pop from empty PriorityQueue.')
+        while self.heap:
+            _, item, live = heapq.heappop(self.heap)
+            if live:
+                del self.index[item]
+                return item
+        raise Exception('Trying to pop from empty PriorityQueue.')
 
     def __len__(self):
         """Return current capacity of PriorityQueue."""
-        return len(self.heap)
+        return len(self.index)
 
     def __contains__(self, key):
         """Return True if the key is in PriorityQueue."""
-        return any([item == key for _, item in self.heap])
+        return key in self.index
 
     def __getitem__(self, key):
-        """Returns the first value associated with key in PriorityQueue.
+        """Returns the value associated with key in PriorityQueue.
         Raises KeyError if key is not present."""
-        for value, item in self.heap:
-            if item == key:
-                return value
-        raise KeyError(str(key) + " is not in the priority queue")
+        try:
+            return self.index[key][0]
+        except KeyError:
+            raise KeyError(str(key) + " is not in the priority queue")
 
     def __delitem__(self, key):
-        """Delete the first occurrence of key."""
+        """Delete the entry of key. The entry is only marked as stale; it
+        is dropped from the heap when it surfaces, or when stale entries
+        outnumber live ones."""
         try:
-            del self.heap[[item == key for _, item in self.heap].index(True)]
-        except ValueError:
+            entry = self.index.pop(key)
+        except KeyError:
             raise KeyError(str(key) + " is not in the priority queue")
-        heapq.heapify(self.heap)
+        entry[2] = False
+        if len(self.heap) > 2 * len(self.index) + 32:
+            self.heap = [e for e in self.heap if e[2]]
+            heapq.heapify(self.heap)
 
 
 #______________________________________________________________________________
@@ -197,6 +262,14 @@ class Problem(object):
         method if checking against a single self.goal is not enough."""
         return state == self.goal
 
+    def state_key(self, state):
+        """Return the key under which the graph searches record the state
+        in their explored set and frontier. States with equal keys are
+        treated as the same state, so a subclass can override this method
+        to collapse states that are equivalent for the search (symmetries,
+        irrelevant details...). The default key is the state itself."""
+        return state
+
     def path_cost(self, c, state1, action, state2):
         """Return the cost of a solution path that arrives at state2 from
         state1 via action, assuming cost c to get up to state1. If the problem
@@ -218,18 +291,30 @@ class Node:
     that this is a successor of) and to the actual state for this node. Note
     that if a state is arrived at by two paths, then there are two nodes with
     the same state.  Also includes the action that got us to this state, and
-    the total path_cost (also known as g) to reach the node.  Other functions
+    the total path_cost (also known as g) to reach the node, and the key of
+    the state (see Problem.state_key) used to compare nodes.  Other functions
     may add an f and h value; see best_first_graph_search and astar_search for
     an explanation of how the f and h values are handled. You will not need to
     subclass this class.
+
+    The attributes are slots, to keep the many nodes of a search small, so
+    no other attribute can be set on a node; a heuristic can keep the work
+    it may reuse on the children of a node in its 'cache' slot. A node whose
+    parent was expanded by best_first_graph_search has no parent node but
+    the index of its parent in the NodeStore of the search (parent_index).
     """
 
-    def __init__(self, state, parent=None, action=None, path_cost=0):
+    __slots__ = ('state', 'key', 'parent', 'action', 'path_cost', 'depth',
+                 'parent_index', 'f', 'h', 'cache')
+
+    def __init__(self, state, parent=None, action=None, path_cost=0, key=None):
         """Create a search tree Node, derived from a parent by an action."""
         self.state = state
+        self.key = state if key is None else key
         self.parent = parent
         self.action = action
         self.path_cost = path_cost
+        self.parent_index = None
         self.depth = 0
         if parent:
             self.depth = parent.depth + 1
@@ -254,7 +339,8 @@ class Node:
         return Node(next_state, # next_state is a state
                     self, # parent is a node
                     action, # from this state to next state 
-                    problem.path_cost(self.path_cost, self.state, action, next_state)
+                    problem.path_cost(self.path_cost, self.state, action, next_state),
+                    problem.state_key(next_state)
                     )
 
     def solution(self):
@@ -273,24 +359,216 @@ class Node:
 
     # We want for a queue of nodes in breadth_first_search or
     # astar_search to have no duplicated states, so we treat nodes
-    # with the same state as equal. [Problem: this may not be what you
+    # with the same state key as equal. [Problem: this may not be what you
     # want in other contexts!]
     
     def __eq__(self, other):
-        return isinstance(other, Node) and self.state == other.state
+        return isinstance(other, Node) and self.key == other.key
 
     def __hash__(self):
-        # We use the hash value of the state
+        # We use the hash value of the state key
         # stored in the node instead of the node
         # object itself to quickly search a node
         # with the same state in a Hash Table        
-        return hash(self.state)
+        return hash(self.key)
+
+
+class NodeStore:
+    """
+    The expanded nodes of a search, kept in parallel typed arrays instead of
+    Node objects: node i (its index, or state id) was reached from node
+    parent[i] (-1 for the root) by the action actions[action[i]], at path
+    cost cost[i], and keys[i] is the key of its state (see Problem.state_key),
+    the object the explored set of the search refers to. Equal actions share
+    one code. The states themselves are not stored; node(i) rebuilds the path
+    to node i by replaying its actions. A node costs 28 bytes here (plus its
+    key, which a Problem can make compact), against well over 100 bytes for
+    a Node with its attributes, and its children refer to it by index (see
+    Node.parent_index) so the Node object and its state can be freed.
+    """
+
+    def __init__(self):
+        self.parent = array.array('q')
+        self.action = array.array('I')
+        self.cost = array.array('d')
+        self.keys = []  # state id -> state key
+        self.actions = []  # action code -> action
+        self.codes = {}  # action -> action code
+
+    def __len__(self):
+        return len(self.parent)
+
+    def add(self, node):
+        """Store node, whose parent is either stored already or None, and
+        return its index."""
+        try:
+            code = self.codes[node.action]
+        except KeyError:
+            code = self.codes[node.action] = len(self.actions)
+            self.actions.append(node.action)
+        except TypeError:  # unhashable action, stored unshared
+            code = len(self.actions)
+            self.actions.append(node.action)
+        parent = node.parent_index
+        self.parent.append(-1 if parent is None else parent)
+        self.action.append(code)
+        self.cost.append(node.path_cost)
+        self.keys.append(node.key)
+        return len(self.parent) - 1
+
+    def solution(self, index):
+        """Return the sequence of actions from the root to node index, in
+        time linear in its length."""
+        parent, action, actions = self.parent, self.action, self.actions
+        path_back = []
+        while parent[index] >= 0:
+            path_back.append(actions[action[index]])
+            index = parent[index]
+        path_back.reverse()
+        return path_back
+
+    def node(self, index, problem):
+        """Return a Node for node index, with its whole chain of parents, by
+        replaying its actions from the initial state of problem."""
+        node = Node(problem.initial, key=problem.state_key(problem.initial))
+        for action in self.solution(index):
+            node = node.child_node(problem, action)
+        return node
+
+#______________________________________________________________________________
+
+class SearchStats:
+    """Statistics of a search. Pass an instance as the stats argument of a
+    search function of this module to have it filled; with stats=None (the
+    default) the searches only pay for an 'is None' test per node.
+
+    Attributes:
+        expanded     : number of nodes expanded
+        generated    : number of child nodes generated
+        duplicates   : generated nodes dropped because their state key was
+                       already explored or queued at a lower or equal cost
+        pruned       : generated nodes dropped by the search itself
+                       (infinite h, beyond the bound of an iteration...)
+        max_frontier : largest number of nodes waiting to be expanded (the
+                       depth of the path for the depth first searches)
+        max_explored : largest number of state keys remembered (explored
+                       set, transposition table entries...)
+        elapsed      : seconds spent in the search functions
+    The counts of the nodes expanded in other processes are added up.
+
+    hook, if given, is called as hook(event, node) for each 'expand'
+    (before its children are generated), 'generate', 'duplicate' and
+    'prune' event. It is not called for the nodes of other processes."""
+
+    COUNTERS = ('expanded', 'generated', 'duplicates', 'pruned',
+                'max_frontier', 'max_explored')
+
+    def __init__(self, hook=None):
+        self.hook = hook
+        self.expanded = self.generated = self.duplicates = self.pruned = 0
+        self.max_frontier = self.max_explored = 0
+        self.elapsed = 0.0
+        self._depth = 0  # number of nested searches running
+        self._start = None
+
+    def start(self):
+        """Start the clock, unless a search is already running."""
+        if self._depth == 0:
+            self._start = time.perf_counter()
+        self._depth += 1
+
+    def stop(self):
+        """Stop the clock when the outermost search returns."""
+        self._depth -= 1
+        if self._depth == 0:
+            self.elapsed += time.perf_counter() - self._start
+
+    def expand(self, node, children):
+        """Record the expansion of node into children."""
+        self.expanded += 1
+        self.generated += len(children)
+        if self.hook is not None:
+            self.hook('expand', node)
+            for child in children:
+                self.hook('generate', child)
+
+    def duplicate(self, node):
+        """Record a generated node dropped as a duplicate."""
+        self.duplicates += 1
+        if self.hook is not None:
+            self.hook('duplicate', node)
+
+    def prune(self, node):
+        """Record a generated node pruned by the search."""
+        self.pruned += 1
+        if self.hook is not None:
+            self.hook('prune', node)
+
+    def sizes(self, frontier, explored=0):
+        """Record the current sizes of the frontier and explored set."""
+        if frontier > self.max_frontier:
+            self.max_frontier = frontier
+        if explored > self.max_explored:
+            self.max_explored = explored
+
+    def merge(self, counters):
+        """Add the counters (a dict, see as_dict) of another process."""
+        for name in SearchStats.COUNTERS:
+            setattr(self, name, getattr(self, name) + counters[name])
+
+    @property
+    def nodes_per_second(self):
+        return self.expanded / self.elapsed if self.elapsed > 0 else 0.0
+
+    def as_dict(self):
+        """Return the counters, elapsed and nodes_per_second in a dict."""
+        counters = {name: getattr(self, name) for name in SearchStats.COUNTERS}
+        counters.update(elapsed=self.elapsed,
+                        nodes_per_second=self.nodes_per_second)
+        return counters
+
+    def __repr__(self):
+        return ('<SearchStats {expanded} expanded, {generated} generated, '
+                '{duplicates} duplicates, {pruned} pruned, frontier <= '
+                '{max_frontier}, explored <= {max_explored}, '
+                '{elapsed:.3f}s>'.format(**self.as_dict()))
+
+
+def collects_stats(search):
+    """Decorator of the search functions that take a stats argument (a
+    SearchStats or None): the time spent in the search is added to
+    stats.elapsed."""
+    @functools.wraps(search)
+    def timed_search(*args, stats=None, **kwargs):
+        if stats is None:
+            return search(*args, **kwargs)
+        stats.start()
+        try:
+            return search(*args, stats=stats, **kwargs)
+        finally:
+            stats.stop()
+    return timed_search
+
+
+def timed_items(items, stats):
+    """Iterate over items (the generator of a search), adding the time
+    spent producing each item to stats.elapsed."""
+    while True:
+        stats.start()
+        try:
+            item = next(items)
+        except StopIteration:
+            return
+        finally:
+            stats.stop()
+        yield item
 
 #______________________________________________________________________________
 
 # Uninformed Search algorithms
 
-def tree_search(problem, frontier):
+@collects_stats
+def tree_search(problem, frontier, stats=None):
     """
         Search through the successors of a problem to find a goal.
         The argument frontier should be an empty queue.
@@ -300,16 +578,21 @@ def tree_search(problem, frontier):
              or None is no goal state is found
     """
     assert isinstance(problem, Problem)
-    frontier.append(Node(problem.initial))
+    frontier.append(Node(problem.initial, key=problem.state_key(problem.initial)))
     while frontier:
         node = frontier.pop()
         if problem.goal_test(node.state):
             return node
-        frontier.extend(node.expand(problem))
+        children = node.expand(problem)
+        frontier.extend(children)
+        if stats is not None:
+            stats.expand(node, children)
+            stats.sizes(len(frontier))
     return None
 
 
-def graph_search(problem, frontier):
+@collects_stats
+def graph_search(problem, frontier, stats=None):
     """
     Search through the successors of a problem to find a goal.
     The argument frontier should be an empty queue.
@@ -319,52 +602,59 @@ def graph_search(problem, frontier):
         or None is no goal state is found
     """
     assert isinstance(problem, Problem)
-    frontier.append(Node(problem.initial))
-    explored = set() # initial empty set of explored states
+    frontier.append(Node(problem.initial, key=problem.state_key(problem.initial)))
+    explored = set() # initial empty set of explored state keys
     while frontier:
         node = frontier.pop()
         if problem.goal_test(node.state):
             return node
-        explored.add(node.state)
-        # Python note: next line uses of a generator
-        frontier.extend(child for child in node.expand(problem)
-                        if child.state not in explored
-                        and child not in frontier)
+        explored.add(node.key)
+        children = node.expand(problem)
+        if stats is not None:
+            stats.expand(node, children)
+        for child in children:
+            if child.key not in explored and child not in frontier:
+                frontier.append(child)
+            elif stats is not None:
+                stats.duplicate(child)
+        if stats is not None:
+            stats.sizes(len(frontier), len(explored))
     return None
 
 
-def breadth_first_tree_search(problem):
+def breadth_first_tree_search(problem, stats=None):
     "Search the shallowest nodes in the search tree first."
-    return tree_search(problem, FIFOQueue())
+    return tree_search(problem, FIFOQueue(), stats=stats)
 
 
-def depth_first_tree_search(problem):
+def depth_first_tree_search(problem, stats=None):
     "Search the deepest nodes in the search tree first."
-    return tree_search(problem, LIFOQueue())
+    return tree_search(problem, LIFOQueue(), stats=stats)
 
 
-def depth_first_graph_search(problem):
+def depth_first_graph_search(problem, stats=None):
     "Search the deepest nodes in the search tree first."
-    return graph_search(problem, LIFOQueue())
+    return graph_search(problem, LIFOQueue(), stats=stats)
 
 
-def breadth_first_graph_search(problem):
+def breadth_first_graph_search(problem, stats=None):
     "Graph search version of BFS.  [Fig. 3.11]"
-    return graph_search(problem, FIFOQueue())
+    return graph_search(problem, FIFOQueue(), stats=stats)
 
 
 # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - 
 
 # Informed Search algorithms
 
-def best_first_tree_search(problem, f):
+@collects_stats
+def best_first_tree_search(problem, f, stats=None):
     """
     Search the nodes with the lowest f scores first.
     You specify the function f(node) that you want to minimize; for example,
     if f is a heuristic estimate to the goal, then we have greedy best
     first search; if f is node.depth then we have breadth-first search.
     """
-    node = Node(problem.initial)
+    node = Node(problem.initial, key=problem.state_key(problem.initial))
     if problem.goal_test(node.state):
         return node
     frontier = PriorityQueue(f=f)
@@ -373,7 +663,10 @@ def best_first_tree_search(problem, f):
         node = frontier.pop()
         if problem.goal_test(node.state):
             return node
-        for child in node.expand(problem):
+        children = node.expand(problem)
+        if stats is not None:
+            stats.expand(node, children)
+        for child in children:
             # test whether a node with the same state
             # exists in the frontier
             if child not in frontier:
@@ -385,56 +678,84 @@ def best_first_tree_search(problem, f):
                     # replace the incumbent with child
                     del frontier[child]
                     frontier.append(child)
+                elif stats is not None:
+                    stats.duplicate(child)
+        if stats is not None:
+            stats.sizes(len(frontier))
     return None
 
 
 
-def best_first_graph_search(problem, f):
+@collects_stats
+def best_first_graph_search(problem, f, stats=None):
     """
     Search the nodes with the lowest f scores first.
     You specify the function f(node) that you want to minimize; for example,
     if f is a heuristic estimate to the goal, then we have greedy best
     first search; if f is node.depth then we have breadth-first search.
+
+    Only the frontier holds Node objects. An expanded node is moved to a
+    NodeStore and its children are detached from it once f has been computed
+    on them, so f may look at node.parent but must be memoized (see
+    astar_graph_search). The node returned is rebuilt from the store.
     """
-    node = Node(problem.initial)
+    node = Node(problem.initial, key=problem.state_key(problem.initial))
     if problem.goal_test(node.state):
         return node
     frontier = PriorityQueue(f=f)
     frontier.append(node)
-    explored = set() # set of states
+    explored = set() # set of state keys
+    store = NodeStore()
     while frontier:
         node = frontier.pop()
+        index = store.add(node)
         if problem.goal_test(node.state):
-            return node
-        explored.add(node.state)
-        for child in node.expand(problem):
-            if child.state not in explored and child not in frontier:
+            return store.node(index, problem)
+        explored.add(store.keys[index])
+        children = node.expand(problem)
+        if stats is not None:
+            stats.expand(node, children)
+        for child in children:
+            if child.key not in explored and child not in frontier:
                 frontier.append(child)
-            elif child in frontier:
+            elif child in frontier and f(child) < frontier[child]:
                 # frontier[child] is the f value of the 
                 # incumbent node that shares the same state as 
                 # the node child.  Read implementation of PriorityQueue
-                if f(child) < frontier[child]:
-                    del frontier[child] # delete the incumbent node
-                    frontier.append(child) # 
+                del frontier[child] # delete the incumbent node
+                frontier.append(child) # 
+            elif stats is not None:
+                stats.duplicate(child)
+        for child in children:
+            child.parent, child.parent_index = None, index
+        if stats is not None:
+            stats.sizes(len(frontier), len(explored))
     return None
 
 
-def uniform_cost_search(problem):
+def uniform_cost_search(problem, stats=None):
     "[Fig. 3.14]"
-    return best_first_graph_search(problem, lambda node: node.path_cost)
+    return best_first_graph_search(problem, lambda node: node.path_cost,
+                                   stats=stats)
 
 
-def depth_limited_search(problem, limit=50):
+@collects_stats
+def depth_limited_search(problem, limit=50, stats=None):
     "[Fig. 3.17]"
     def recursive_dls(node, problem, limit):
         if problem.goal_test(node.state):
             return node
         elif node.depth == limit:
+            if stats is not None:
+                stats.prune(node)
             return 'cutoff'
         else:
             cutoff_occurred = False
-            for child in node.expand(problem):
+            children = node.expand(problem)
+            if stats is not None:
+                stats.expand(node, children)
+                stats.sizes(node.depth + 1)
+            for child in children:
                 result = recursive_dls(child, problem, limit)
                 if result == 'cutoff':
                     cutoff_occurred = True
@@ -449,10 +770,11 @@ def depth_limited_search(problem, limit=50):
     return recursive_dls(Node(problem.initial), problem, limit)
 
 
-def iterative_deepening_search(problem):
+@collects_stats
+def iterative_deepening_search(problem, stats=None):
     "[Fig. 3.18]"
     for depth in itertools.count():
-        result = depth_limited_search(problem, depth)
+        result = depth_limited_search(problem, depth, stats=stats)
         if result != 'cutoff':
             return result
 
@@ -462,20 +784,488 @@ def iterative_deepening_search(problem):
 greedy_best_first_graph_search = best_first_graph_search
 # Greedy best-first search is accomplished by specifying f(n) = h(n).
 
-def astar_graph_search(problem, h=None):
+def astar_graph_search(problem, h=None, stats=None):
     """A* search is best-first graph search with f(n) = g(n)+h(n).
     You need to specify the h function when you call astar_search, or
     else in your Problem subclass."""
     h = memoize(h or problem.h, slot='h')
-    return best_first_graph_search(problem, lambda n: n.path_cost + h(n))
+    return best_first_graph_search(problem, lambda n: n.path_cost + h(n),
+                                   stats=stats)
 
 
-def astar_tree_search(problem, h=None):
+def astar_tree_search(problem, h=None, stats=None):
     """A* search is best-first graph search with f(n) = g(n)+h(n).
     You need to specify the h function when you call astar_search, or
     else in your Problem subclass."""
     h = memoize(h or problem.h, slot='h')
-    return best_first_tree_search(problem, lambda n: n.path_cost + h(n))
+    return best_first_tree_search(problem, lambda n: n.path_cost + h(n),
+                                  stats=stats)
+
+
+@collects_stats
+def ida_star_search(problem, h=None, table_size=1 << 18, stats=None):
+    """Iterative deepening A* search. Each iteration is a depth first search
+    that cuts off the nodes with f(n) = g(n)+h(n) above a bound, and the next
+    bound is the smallest f value that was cut off. Only the current path and
+    the siblings of its nodes are kept alive, plus a transposition table.
+
+    The transposition table has table_size slots; the slot of a node is
+    hash(node.key) % table_size and holds [key, g, iteration, f] for the last
+    node stored there, where f is the smallest f value cut off below the node
+    once its subtree has been searched. A node is pruned if its slot shows
+    the same key reached with a smaller g, or with the same g earlier in the
+    same iteration (its subtree has then already been searched). When the
+    same key is met again with the same g in a later iteration, f is used
+    as a better estimate than g(n)+h(n). A slot is overwritten by a node of
+    another key if the slot was filled in an earlier iteration or if the new
+    node has a smaller or equal g, so the entries nearer the root, which
+    save the most work, are kept.
+    With an admissible h, the first goal found is optimal.
+
+    You need to specify the h function when you call ida_star_search, or
+    else in your Problem subclass.
+    Return
+        the node of the goal state found
+        or None if no goal state is found"""
+    h = memoize(h or problem.h, slot='h')
+    root = Node(problem.initial, key=problem.state_key(problem.initial))
+    table = [None] * table_size
+    filled = 0  # number of slots of the table in use
+    bound = h(root)
+    for iteration in itertools.count():
+        if bound == float('inf'):
+            return None
+        # frames [node, children left to visit, smallest f cut off below
+        # the node, table entry of the node]
+        stack = [[None, [root], float('inf'), None]]
+        while len(stack) > 1 or stack[0][1]:
+            frame = stack[-1]
+            if not frame[1]:  # all the children have been searched
+                stack.pop()
+                node, _, f, entry = frame
+                if entry is not None and table[hash(node.key) % table_size] is entry:
+                    entry[3] = f
+                if f < stack[-1][2]:
+                    stack[-1][2] = f
+                continue
+            node = frame[1].pop()
+            g = node.path_cost
+            f = g + h(node)
+            slot = hash(node.key) % table_size
+            entry = table[slot]
+            if entry is not None and entry[0] == node.key:
+                if entry[1] < g or (entry[1] == g and entry[2] == iteration):
+                    if stats is not None:
+                        stats.duplicate(node)
+                    continue  # searched from a path at least as cheap
+                if entry[1] == g and entry[3] is not None and entry[3] > f:
+                    f = entry[3]
+            if f > bound:
+                if f < frame[2]:
+                    frame[2] = f
+                if stats is not None:
+                    stats.prune(node)
+                continue
+            if problem.goal_test(node.state):
+                return node
+            if entry is None:
+                filled += 1
+            if (entry is None or entry[0] == node.key or entry[2] != iteration
+                    or g <= entry[1]):
+                entry = table[slot] = [node.key, g, iteration, None]
+            else:
+                entry = None
+            # visit the children with the smallest f first
+            children = node.expand(problem)
+            if stats is not None:
+                stats.expand(node, children)
+                stats.sizes(len(stack), filled)
+            children.sort(key=lambda n: n.path_cost + h(n), reverse=True)
+            stack.append([node, children, float('inf'), entry])
+        bound = stack[0][2]
+
+def anytime_weighted_astar_search(problem, h=None,
+                                  weights=(5, 3, 2, 1.5, 1.25, 1),
+                                  time_limit=None, node_limit=None,
+                                  stats=None):
+    """Anytime repairing A* (ARA*): a sequence of weighted A* searches with
+    f(n) = g(n) + w*h(n), one for each weight w of weights (decreasing, the
+    last one normally 1). The first search finds a solution quickly, and
+    each of the next ones improves on it while reusing the work of the
+    previous ones: the cheapest node found so far for each state key is
+    kept, and the next search starts from the frontier of the previous one
+    plus the already expanded nodes whose cost has since decreased.
+    A search stops as soon as no node of its frontier can lead to a
+    cheaper solution than the best one found at its weight.
+
+    The searches stop as soon as the solution found is proven optimal
+    (bound 1), or when time_limit seconds have passed or node_limit nodes
+    have been expanded (None for no limit).
+
+    You need to specify the h function when you call
+    anytime_weighted_astar_search, or else in your Problem subclass.
+    Yield
+        (node, bound) after each search that found a solution, where node
+        is the best goal node found so far and bound the factor by which
+        its path cost may exceed the optimal cost (1 if it is optimal).
+        If the budget runs out before any solution is found, the last
+        item is (None, inf). Nothing is yielded if the problem has no
+        solution.
+    stats.elapsed only counts the time spent in the generator, not the time
+    spent by the caller between two items."""
+    items = _anytime_weighted_astar(problem, h, weights, time_limit,
+                                    node_limit, stats)
+    return items if stats is None else timed_items(items, stats)
+
+
+def _anytime_weighted_astar(problem, h, weights, time_limit, node_limit,
+                            stats):
+    """The generator of anytime_weighted_astar_search."""
+    h = memoize(h or problem.h, slot='h')
+    deadline = None if time_limit is None else time.monotonic() + time_limit
+    root = Node(problem.initial, key=problem.state_key(problem.initial))
+    if problem.goal_test(root.state):
+        yield root, 1
+        return
+    best = {root.key: root}  # cheapest node found for each state key
+    incumbent = None  # cheapest goal node found
+    pending = [root]  # nodes to put on the frontier of the next search
+    expanded = 0
+    for w in weights:
+        f = lambda n, w=w: n.path_cost + w * h(n)
+        frontier = PriorityQueue(f=f)
+        frontier.extend(pending)
+        closed = set()  # state keys expanded by this search
+        incons = {}  # expanded nodes reached again at a lower cost
+        out_of_budget = False
+        while frontier:
+            node = frontier.pop()
+            if incumbent is not None and f(node) >= incumbent.path_cost:
+                frontier.append(node)
+                break
+            if ((deadline is not None and time.monotonic() > deadline)
+                    or (node_limit is not None and expanded >= node_limit)):
+                frontier.append(node)
+                out_of_budget = True
+                break
+            closed.add(node.key)
+            expanded += 1
+            children = node.expand(problem)
+            if stats is not None:
+                stats.expand(node, children)
+            for child in children:
+                known = best.get(child.key)
+                if known is not None and known.path_cost <= child.path_cost:
+                    if stats is not None:
+                        stats.duplicate(child)
+                    continue
+                best[child.key] = child
+                if problem.goal_test(child.state):
+                    if (incumbent is None
+                            or child.path_cost < incumbent.path_cost):
+                        incumbent = child
+                elif h(child) == float('inf'):
+                    if stats is not None:
+                        stats.prune(child)
+                    continue  # dead end
+                elif child.key in closed:
+                    incons[child.key] = child
+                else:
+                    frontier.append(child)
+            if stats is not None:
+                stats.sizes(len(frontier), len(best))
+        pending = list(frontier.index) + list(incons.values())
+        if incumbent is not None:
+            # the optimal cost is at least the smallest g+h still pending
+            lower = min([n.path_cost + h(n) for n in pending]
+                        + [incumbent.path_cost])
+            bound = (incumbent.path_cost / lower if lower > 0
+                     else float('inf'))
+            yield incumbent, bound
+            if bound <= 1:
+                return  # proven optimal, the next weights can't improve it
+        elif out_of_budget:
+            yield None, float('inf')
+        elif not frontier:
+            return  # every reachable state was expanded, no solution
+        if out_of_budget or not pending:
+            return
+
+
+@collects_stats
+def bidirectional_search(forward, backward, h_forward=None, h_backward=None,
+                         stats=None):
+    """Bidirectional best-first graph search. forward is searched from its
+    initial state with f(n) = g(n)+h(n) as in astar_graph_search, and
+    backward from each state of the sequence backward.initial (typically
+    every goal state of forward) with the actions of forward reversed.
+    At each step the direction with the smaller frontier is expanded.
+    The two searches share the state keys (see Problem.state_key): as soon
+    as one of them generates a key already generated by the other one,
+    the two paths meet. A goal node of forward popped from its frontier
+    ends the search as well.
+
+    The first meeting is returned, so the two halves together are not
+    guaranteed to be a path of minimum cost. The backward search may give
+    up (run out of frontier) without harm, the forward search is complete.
+
+    You need to specify the h functions when you call bidirectional_search,
+    or else in your Problem subclasses.
+    Return
+        (forward node, backward node) of the meeting, where backward node
+        is None if the forward search reached a goal on its own, or None
+        if forward has no solution."""
+    h_forward = memoize(h_forward or forward.h, slot='h')
+    h_backward = memoize(h_backward or backward.h, slot='h')
+    sides = []
+    for problem, h, roots in ((forward, h_forward, [forward.initial]),
+                              (backward, h_backward, backward.initial)):
+        f = lambda n, h=h: n.path_cost + h(n)
+        frontier = PriorityQueue(f=f)
+        generated = {}  # state key -> node of its frontier entry
+        for state in roots:
+            node = Node(state, key=problem.state_key(state))
+            generated[node.key] = node
+            frontier.append(node)
+        sides.append((problem, h, f, frontier, generated, set()))
+    root = next(iter(sides[0][4].values()))
+    if root.key in sides[1][4]:
+        return root, sides[1][4][root.key]
+    if forward.goal_test(root.state):
+        return root, None
+    while sides[0][3]:
+        side = 1 if 0 < len(sides[1][3]) < len(sides[0][3]) else 0
+        problem, h, f, frontier, generated, explored = sides[side]
+        other = sides[1 - side][4]
+        node = frontier.pop()
+        if side == 0 and problem.goal_test(node.state):
+            return node, None
+        explored.add(node.key)
+        children = node.expand(problem)
+        if stats is not None:
+            stats.expand(node, children)
+        for child in children:
+            if child.key in other:
+                meeting = child, other[child.key]
+                return meeting if side == 0 else meeting[::-1]
+            if child.key in explored:
+                if stats is not None:
+                    stats.duplicate(child)
+            elif h(child) == float('inf'):
+                if stats is not None:
+                    stats.prune(child)
+            elif child not in frontier or f(child) < frontier[child]:
+                frontier.append(child)  # replaces the queued entry
+                generated[child.key] = child
+            elif stats is not None:
+                stats.duplicate(child)
+        if stats is not None:
+            stats.sizes(len(sides[0][3]) + len(sides[1][3]),
+                        len(sides[0][5]) + len(sides[1][5]))
+    return None
+
+
+class _RootNode(Node):
+    """Node received by a worker of hash_distributed_astar_search, which
+    carries the actions from the initial state to it (prefix)."""
+
+    __slots__ = ('prefix',)
+
+
+def _hda_worker(rank, problem, inboxes, results, stop, idle, sent, received,
+                bound, batch_size, collect_stats):
+    """Worker process of hash_distributed_astar_search. It owns the states
+    whose key hashes to rank, and runs A* on them with its own frontier and
+    table of best path costs. The children owned by another worker are sent
+    to it in batches of (state, path cost, actions from the initial state).
+    Nodes are reopened when they are reached again at a lower cost.
+    The goals found are put on results as ('goal', cost, actions) and, if
+    collect_stats is set, the counters of the worker (see SearchStats) as
+    ('stats', counters) when it stops."""
+    stats = SearchStats() if collect_stats else None
+    nworkers = len(inboxes)
+    h = memoize(problem.h, slot='h')
+    f = lambda n: n.path_cost + h(n)
+    frontier = PriorityQueue(f=f)
+    best = {}  # state key -> lowest path cost found
+    outboxes = [[] for _ in range(nworkers)]
+
+    def consider(node):
+        known = best.get(node.key)
+        if known is not None and known <= node.path_cost:
+            if stats is not None:
+                stats.duplicate(node)
+            return
+        if h(node) == float('inf'):
+            if stats is not None:
+                stats.prune(node)
+            return
+        best[node.key] = node.path_cost
+        frontier.append(node)  # replaces the queued entry
+
+    def path(node):
+        # the nodes received from another worker carry their prefix
+        actions = []
+        while node.parent:
+            actions.append(node.action)
+            node = node.parent
+        return node.prefix + tuple(reversed(actions))
+
+    def flush(dest):
+        if outboxes[dest]:
+            with sent.get_lock():
+                sent.value += 1
+            inboxes[dest].put(outboxes[dest])
+            outboxes[dest] = []
+
+    def receive(batch):
+        idle[rank] = 0
+        for state, g, prefix in batch:
+            node = _RootNode(state, path_cost=g,
+                             key=problem.state_key(state))
+            node.prefix = prefix
+            consider(node)
+        with received.get_lock():
+            received.value += 1
+
+    root = _RootNode(problem.initial, key=problem.state_key(problem.initial))
+    if hash(root.key) % nworkers == rank:
+        root.prefix = ()
+        consider(root)
+    inbox = inboxes[rank]
+    while not stop.is_set():
+        while True:
+            try:
+                receive(inbox.get_nowait())
+            except queue.Empty:
+                break
+        working = False
+        for _ in range(batch_size):
+            if not frontier:
+                break
+            node = frontier.pop()
+            if f(node) >= bound.value:
+                frontier.append(node)
+                break
+            working = True
+            if problem.goal_test(node.state):
+                with bound.get_lock():
+                    if node.path_cost < bound.value:
+                        bound.value = node.path_cost
+                        results.put(('goal', node.path_cost, path(node)))
+                continue
+            children = node.expand(problem)
+            if stats is not None:
+                stats.expand(node, children)
+                stats.sizes(len(frontier), len(best))
+            for child in children:
+                dest = hash(child.key) % nworkers
+                if dest == rank:
+                    consider(child)
+                    continue
+                outboxes[dest].append((child.state, child.path_cost,
+                                       path(child)))
+                if len(outboxes[dest]) >= batch_size:
+                    flush(dest)
+        for dest in range(nworkers):
+            flush(dest)
+        if not working:
+            idle[rank] = 1
+            try:
+                receive(inbox.get(timeout=0.01))
+            except queue.Empty:
+                pass
+    # the batches still queued are not needed any more
+    for q in inboxes:
+        q.cancel_join_thread()
+    if stats is not None:
+        results.put(('stats', stats.as_dict()))
+
+
+@collects_stats
+def hash_distributed_astar_search(problem, processes=None, batch_size=64,
+                                  stats=None):
+    """Hash distributed A* (HDA*). The states are shared out between
+    processes worker processes by the hash of their key (see
+    Problem.state_key): each worker keeps the frontier and the best path
+    costs of its own states, and sends the children it generates for the
+    other workers through their queues, in batches of up to batch_size.
+    The cost of the best goal found is shared, and a worker only expands
+    the nodes of its frontier with f(n) = g(n)+h(n) below it.
+
+    The search ends when every worker is out of such nodes and no batch is
+    in flight (counted by the shared sent and received totals), so the
+    goal found is optimal for an admissible h of the problem.
+
+    The problem is passed to the worker processes, so it has to be
+    picklable, and the hashes of the state keys must be the same in every
+    process (no str in the keys unless PYTHONHASHSEED is set).
+    The statistics of the workers are added up in stats (max_frontier and
+    max_explored are the sums of the largest sizes of each worker).
+    Return
+        The goal node, rebuilt in this process from the actions found, or
+        None if the problem has no solution."""
+    if processes is None:
+        processes = os.cpu_count() or 1
+    inboxes = [multiprocessing.Queue() for _ in range(processes)]
+    results = multiprocessing.Queue()
+    stop = multiprocessing.Event()
+    idle = multiprocessing.Array('b', processes, lock=False)
+    sent = multiprocessing.Value('q', 0)
+    received = multiprocessing.Value('q', 0)
+    bound = multiprocessing.Value('d', float('inf'))
+    workers = [multiprocessing.Process(
+        target=_hda_worker, daemon=True,
+        args=(rank, problem, inboxes, results, stop, idle, sent, received,
+              bound, batch_size, stats is not None))
+        for rank in range(processes)]
+    for worker in workers:
+        worker.start()
+    best = None  # (cost, actions) of the best goal received
+    try:
+        while True:
+            try:
+                _, cost, actions = results.get(timeout=0.01)
+                if best is None or cost < best[0]:
+                    best = cost, actions
+                continue
+            except queue.Empty:
+                pass
+            if not all(worker.is_alive() for worker in workers):
+                raise RuntimeError('a worker process of '
+                                   'hash_distributed_astar_search died.')
+            counts = sent.value, received.value
+            if (counts[0] == counts[1] and all(idle)
+                    and (sent.value, received.value) == counts):
+                break
+        # a goal put just before its worker went idle may still be in transit
+        while bound.value < float('inf') and (best is None
+                                              or best[0] > bound.value):
+            _, cost, actions = results.get()
+            if best is None or cost < best[0]:
+                best = cost, actions
+    finally:
+        stop.set()
+        if stats is not None:
+            reports = 0
+            while reports < processes:
+                try:
+                    message = results.get(timeout=1)
+                except queue.Empty:
+                    break  # a worker died, its counters are lost
+                if message[0] == 'stats':
+                    stats.merge(message[1])
+                    reports += 1
+        for worker in workers:
+            worker.join(timeout=1)
+            if worker.is_alive():
+                worker.terminate()
+    if best is None:
+        return None
+    node = Node(problem.initial, key=problem.state_key(problem.initial))
+    for action in best[1]:
+        node = node.child_node(problem, action)
+    return node
 
 #______________________________________________________________________________
 #